@@ -0,0 +1,5 @@
+import django
+
+# Django 3.2 and later find the app config automatically
+if django.VERSION < (3, 2):
+    default_app_config = 'idempotency_key.apps.IdempotencyKeyConfig'
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class IdempotencyKeyConfig(AppConfig):
+    name = 'idempotency_key'
+    verbose_name = 'Idempotency key'
+
+    def ready(self):
+        # Register the system checks
+        from idempotency_key import checks  # noqa: F401
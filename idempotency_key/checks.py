@@ -0,0 +1,242 @@
+from numbers import Number
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import get_resolver
+
+from idempotency_key import utils
+from idempotency_key.locks import MultiProcessRedisLock
+from idempotency_key.storage import MemoryKeyStorage, RedisKeyStorage
+
+CLASS_SETTINGS = (
+    ('ENCODER_CLASS', utils.get_encoder_class),
+    ('STORAGE.CLASS', utils.get_storage_class),
+    ('STORAGE.SERIALIZER_CLASS', utils.get_storage_serializer_class),
+    ('LOCK.CLASS', utils.get_lock_class),
+)
+
+
+def get_view_functions(patterns):
+    """
+    Get the name and function of every view function in the URL patterns, including the methods used for each action
+    of DRF viewsets. The patterns are told apart by their attributes because django < 2.0 calls the URLResolver and
+    URLPattern classes RegexURLResolver and RegexURLPattern.
+    """
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from get_view_functions(pattern.url_patterns)
+        elif hasattr(pattern, 'callback'):
+            callback = pattern.callback
+            yield '{}.{}'.format(callback.__module__, callback.__name__), callback
+            # If there is an actions attribute then the function is wrapped in a DRF viewset
+            for func_name in getattr(callback, 'actions', dict()).values():
+                func = getattr(callback.cls, func_name, None)
+                if func is not None:
+                    yield '{}.{}.{}'.format(callback.cls.__module__, callback.cls.__name__, func_name), func
+
+
+def get_cache_names():
+    """
+    Get the cache names used by the view functions in the URLconf, and the default storage cache name, mapped to the
+    names of the view functions that use them.
+    """
+    cache_names = {utils.get_storage_cache_name(): ['STORAGE.CACHE_NAME setting']}
+    for name, func in get_view_functions(get_resolver().url_patterns):
+        cache_name = getattr(func, 'idempotency_key_cache_name', None)
+        if cache_name and name not in cache_names.get(cache_name, ()):
+            cache_names.setdefault(cache_name, []).append(name)
+    return cache_names
+
+
+def check_classes():
+    errors = []
+    classes = dict()
+    for name, get_class in CLASS_SETTINGS:
+        try:
+            classes[name] = get_class()
+        except ImportError as e:
+            errors.append(checks.Error(
+                'The {} idempotency key setting cannot be imported: {}'.format(name, e),
+                id='idempotency_key.E001',
+            ))
+
+    encoder_class = classes.get('ENCODER_CLASS')
+    if encoder_class is not None:
+        try:
+            encoder_class()
+        except ImproperlyConfigured as e:
+            errors.append(checks.Error(str(e), id='idempotency_key.E002'))
+
+    return errors, classes.get('STORAGE.CLASS'), classes.get('LOCK.CLASS')
+
+
+def check_encoder_output(storage_class):
+    # Raw keys are bytes, which django cache keys cannot be
+    if utils.get_encoder_output() == 'raw' and not issubclass(storage_class, (MemoryKeyStorage, RedisKeyStorage)):
+        return [checks.Error(
+            'The "raw" ENCODER_OUTPUT idempotency key setting cannot be used with {}.'.format(storage_class.__name__),
+            hint='Use MemoryKeyStorage or RedisKeyStorage, or the "hex" or "base64url" ENCODER_OUTPUT.',
+            id='idempotency_key.E007',
+        )]
+    return []
+
+
+def check_cache_names(storage_class):
+    errors = []
+    for cache_name, used_by in get_cache_names().items():
+        try:
+            storage_class.validate_storage(cache_name)
+        except Exception as e:
+            errors.append(checks.Error(
+                'The idempotency key cache name "{}" is not valid for {}: {}'.format(
+                    cache_name, storage_class.__name__, e
+                ),
+                hint='Used by {}.'.format(', '.join(used_by)),
+                id='idempotency_key.E003',
+            ))
+    return errors
+
+
+def check_lock_timeouts():
+    errors = []
+
+    timeout = utils.get_lock_timeout()
+    if not isinstance(timeout, Number) or timeout < 0:
+        errors.append(checks.Error(
+            'The LOCK.TIMEOUT idempotency key setting must be a number of seconds, not {!r}.'.format(timeout),
+            id='idempotency_key.E004',
+        ))
+
+    ttl = utils.get_lock_time_to_live()
+    if ttl is not None and (not isinstance(ttl, Number) or ttl <= 0):
+        errors.append(checks.Error(
+            'The LOCK.TTL idempotency key setting must be None or a positive number of seconds, not {!r}.'.format(ttl),
+            id='idempotency_key.E004',
+        ))
+
+    return errors
+
+
+def check_lock_settings(lock_class):
+    errors = check_lock_timeouts()
+
+    stripes = utils.get_lock_stripes()
+    if not isinstance(stripes, int) or stripes < 1:
+        errors.append(checks.Error(
+            'The LOCK.STRIPES idempotency key setting must be a positive integer, not {!r}.'.format(stripes),
+            id='idempotency_key.E004',
+        ))
+
+    if lock_class is not None and issubclass(lock_class, MultiProcessRedisLock) and not utils.get_lock_location():
+        errors.append(checks.Error(
+            'The LOCK.LOCATION idempotency key setting must be set to use {}.'.format(lock_class.__name__),
+            id='idempotency_key.E004',
+        ))
+
+    return errors
+
+
+def check_storage_timeouts():
+    errors = []
+
+    deadline_ms = utils.get_storage_deadline_ms()
+    if deadline_ms is not None and (not isinstance(deadline_ms, Number) or deadline_ms <= 0):
+        errors.append(checks.Error(
+            'The STORAGE.DEADLINE_MS idempotency key setting must be None or a positive number of milliseconds, '
+            'not {!r}.'.format(deadline_ms),
+            id='idempotency_key.E006',
+        ))
+
+    timeout = utils.get_storage_settings().get('TIMEOUT')
+    if timeout is not None and (not isinstance(timeout, Number) or timeout <= 0):
+        errors.append(checks.Error(
+            'The STORAGE.TIMEOUT idempotency key setting must be None or a positive number of seconds, '
+            'not {!r}.'.format(timeout),
+            id='idempotency_key.E006',
+        ))
+
+    return errors
+
+
+def check_storage_settings():
+    errors = check_storage_timeouts()
+
+    database = utils.get_storage_store_on_commit_database()
+    if utils.get_storage_store_on_commit() and database not in settings.DATABASES:
+        errors.append(checks.Error(
+            'The STORAGE.STORE_ON_COMMIT_DATABASE idempotency key setting must be a database alias in DATABASES, '
+            'not {!r}.'.format(database),
+            id='idempotency_key.E006',
+        ))
+
+    queue_size = utils.get_storage_write_behind_queue_size()
+    if not isinstance(queue_size, int) or queue_size < 1:
+        errors.append(checks.Error(
+            'The STORAGE.WRITE_BEHIND_QUEUE_SIZE idempotency key setting must be a positive integer, not {!r}.'.format(
+                queue_size
+            ),
+            id='idempotency_key.E006',
+        ))
+
+    return errors
+
+
+def check_circuit_breaker_settings():
+    errors = []
+
+    mode = utils.get_circuit_breaker_mode()
+    if mode not in ('fail-open', 'fail-closed'):
+        errors.append(checks.Error(
+            'The CIRCUIT_BREAKER.MODE idempotency key setting must be "fail-open" or "fail-closed", '
+            'not {!r}.'.format(mode),
+            id='idempotency_key.E005',
+        ))
+
+    failure_rate = utils.get_circuit_breaker_failure_rate()
+    if not isinstance(failure_rate, Number) or not 0 < failure_rate <= 1:
+        errors.append(checks.Error(
+            'The CIRCUIT_BREAKER.FAILURE_RATE idempotency key setting must be a number greater than 0 and at most 1, '
+            'not {!r}.'.format(failure_rate),
+            id='idempotency_key.E005',
+        ))
+
+    for name, value in (
+            ('WINDOW', utils.get_circuit_breaker_window()),
+            ('RESET_TIMEOUT', utils.get_circuit_breaker_reset_timeout()),
+    ):
+        if not isinstance(value, Number) or value <= 0:
+            errors.append(checks.Error(
+                'The CIRCUIT_BREAKER.{} idempotency key setting must be a positive number of seconds, not {!r}.'.format(
+                    name, value
+                ),
+                id='idempotency_key.E005',
+            ))
+
+    return errors
+
+
+@checks.register('idempotency_key')
+def check_settings(app_configs, **kwargs):
+    """
+    Check the idempotency key settings and the cache names used by every view function in the URLconf together, so that
+    all of the problems are reported at once when the project starts.
+    """
+    errors, storage_class, lock_class = check_classes()
+    if storage_class is not None:
+        errors.extend(check_encoder_output(storage_class))
+        errors.extend(check_cache_names(storage_class))
+    errors.extend(check_storage_settings())
+    errors.extend(check_lock_settings(lock_class))
+    errors.extend(check_circuit_breaker_settings())
+    return errors
+
+
+def validate_settings():
+    """
+    Raise ImproperlyConfigured listing every problem found by check_settings. The middleware uses this when the app is
+    not in INSTALLED_APPS, since nothing registers the system check before the checks run then.
+    """
+    errors = check_settings(None)
+    if errors:
+        raise ImproperlyConfigured('\n'.join(str(error) for error in errors))
@@ -0,0 +1,138 @@
+from collections import deque
+import logging
+import threading
+import time
+
+logger = logging.getLogger('django-idempotency-key.idempotency_key.circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the storage and lock calls made for each request over a sliding window of the last `window` seconds. A call
+    fails if it raises an exception or takes longer than `slow_call_duration` seconds.
+
+    Once at least `min_calls` calls were made in the window and the fraction of them that failed reaches
+    `failure_rate` the circuit opens and allow_request() returns False, so the storage and lock are not used at all.
+    After `reset_timeout` seconds the circuit is half-open and a single request is allowed through as a probe. The
+    circuit closes again if the probe succeeds, otherwise it stays open for another `reset_timeout` seconds. A probe
+    that is never recorded is replaced by a new one after another `reset_timeout` seconds.
+    """
+
+    def __init__(self, window=30, min_calls=20, failure_rate=0.5, slow_call_duration=None, reset_timeout=30,
+                 clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.probe_started_at = None
+
+        # The number of requests that were not allowed through while the circuit was open
+        self.rejected = 0
+
+        # The number of requests that were passed through without using the storage or lock when failing open
+        self.bypassed = 0
+
+        # [second, calls, failures] for each second of the window that had any calls, oldest first
+        self.buckets = deque()
+        self.calls = 0
+        self.failures = 0
+
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.probing = False
+
+            # Only one probe is allowed through at a time while half-open. A probe that has not been recorded after
+            # reset_timeout seconds, for example because its request was cancelled, is replaced by a new one.
+            if self.state == HALF_OPEN and (
+                    not self.probing or self.clock() - self.probe_started_at >= self.reset_timeout
+            ):
+                self.probing = True
+                self.probe_started_at = self.clock()
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record(self, duration, failed=False):
+        """
+        Record a call that took `duration` seconds.
+        """
+        if self.slow_call_duration is not None and duration >= self.slow_call_duration:
+            failed = True
+
+        with self.lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._close()
+                return
+
+            # Ignore calls that started before the circuit opened
+            if self.state == OPEN:
+                return
+
+            self._add_call(failed)
+
+            if self.calls >= self.min_calls and self.failures >= self.failure_rate * self.calls:
+                logger.warning(
+                    'Idempotency key circuit breaker opened: %s of %s storage and lock calls failed in the last %ss',
+                    self.failures, self.calls, self.window
+                )
+                self._open()
+
+    def _add_call(self, failed):
+        """
+        Count a call in the bucket for the current second and drop the buckets that have left the window.
+        """
+        now = int(self.clock())
+        if self.buckets and self.buckets[-1][0] == now:
+            bucket = self.buckets[-1]
+        else:
+            bucket = [now, 0, 0]
+            self.buckets.append(bucket)
+        bucket[1] += 1
+        bucket[2] += failed
+        self.calls += 1
+        self.failures += failed
+
+        while self.buckets[0][0] <= now - self.window:
+            _, calls, failures = self.buckets.popleft()
+            self.calls -= calls
+            self.failures -= failures
+
+    def record_bypass(self):
+        with self.lock:
+            self.bypassed += 1
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.probing = False
+
+    def _close(self):
+        logger.warning('Idempotency key circuit breaker closed')
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.probe_started_at = None
+        self.buckets.clear()
+        self.calls = 0
+        self.failures = 0
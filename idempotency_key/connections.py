@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import threading
+import weakref
+
+from idempotency_key import deadlines
+from idempotency_key.exceptions import DeadlineExceededError
+
+_connection_pools = dict()
+_connection_pools_lock = threading.Lock()
+
+# Async clients keyed by event loop and then by (location, max_connections)
+_async_connections = weakref.WeakKeyDictionary()
+
+
+class DeadlineConnectionMixin(object):
+    """
+    Limits the time each command waits for the server to the remaining DEADLINE_MS budget of the request being
+    processed, so that the connection pool can be shared by calls made with and without a budget.
+    """
+
+    def read_response(self, *args, **kwargs):
+        timeout = deadlines.get_timeout(self.socket_timeout)
+        if timeout == self.socket_timeout or self._sock is None:
+            return super().read_response(*args, **kwargs)
+
+        from redis.exceptions import TimeoutError as RedisTimeoutError
+
+        # A timeout of 0 would make the socket non-blocking, so wait at least a millisecond for the server
+        self._sock.settimeout(max(timeout, 0.001))
+        try:
+            return super().read_response(*args, **kwargs)
+        except RedisTimeoutError as e:
+            # The budget ran out rather than the socket timeout of the connection
+            raise DeadlineExceededError() from e
+        finally:
+            if self._sock is not None:
+                self._sock.settimeout(self.socket_timeout)
+
+
+@functools.lru_cache(maxsize=None)
+def get_deadline_connection_class(connection_class):
+    """
+    Get the subclass of the redis connection class chosen for a location that also uses DeadlineConnectionMixin.
+    """
+    return type(connection_class.__name__, (DeadlineConnectionMixin, connection_class), dict())
+
+
+def get_connection_pool(location: str, max_connections: int = None):
+    """
+    Get the connection pool for the Redis server location. One pool is created per location and maximum number of
+    connections and is shared by every lock and storage object in the process. If max_connections is specified then
+    callers wait for a connection to become free instead of opening more than that number of connections.
+    """
+    from redis import BlockingConnectionPool, ConnectionPool
+
+    pool_key = (location, max_connections)
+    with _connection_pools_lock:
+        connection_pool = _connection_pools.get(pool_key)
+        if connection_pool is None:
+            if max_connections is None:
+                connection_pool = ConnectionPool.from_url(location)
+            else:
+                connection_pool = BlockingConnectionPool.from_url(location, max_connections=max_connections)
+            connection_pool.connection_class = get_deadline_connection_class(connection_pool.connection_class)
+            _connection_pools[pool_key] = connection_pool
+
+    return connection_pool
+
+
+def get_redis_connection(location: str, max_connections: int = None, django_cache: str = None):
+    """
+    Get a Redis client that uses a shared connection pool.
+    :param location: The Redis server location
+    :param max_connections: The maximum number of connections in the pool, or None for no limit
+    :param django_cache: If specified, the name of a django-redis cache under CACHES whose client is reused instead
+    :return: the Redis client
+    """
+    if django_cache:
+        from django_redis import get_redis_connection as get_django_redis_connection
+
+        return get_django_redis_connection(django_cache)
+
+    from redis import Redis
+
+    return Redis(connection_pool=get_connection_pool(location, max_connections))
+
+
+def get_async_redis_connection(location: str, max_connections: int = None):
+    """
+    Get a redis.asyncio client for the running event loop. Async connections cannot be used by more than one event
+    loop so a client, with its own connection pool, is created per event loop, location and maximum number of
+    connections. Must be called from a coroutine.
+    :param location: The Redis server location
+    :param max_connections: The maximum number of connections in the pool, or None for no limit
+    :return: the async Redis client
+    """
+    from redis.asyncio import BlockingConnectionPool, ConnectionPool, Redis
+
+    loop = asyncio.get_event_loop()
+    client_key = (location, max_connections)
+    with _connection_pools_lock:
+        loop_connections = _async_connections.get(loop)
+        if loop_connections is None:
+            loop_connections = _async_connections[loop] = dict()
+
+        redis_obj = loop_connections.get(client_key)
+        if redis_obj is None:
+            if max_connections is None:
+                connection_pool = ConnectionPool.from_url(location)
+            else:
+                connection_pool = BlockingConnectionPool.from_url(location, max_connections=max_connections)
+            redis_obj = loop_connections[client_key] = Redis(connection_pool=connection_pool)
+
+    return redis_obj
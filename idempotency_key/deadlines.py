@@ -0,0 +1,114 @@
+import asyncio
+from contextlib import contextmanager
+import threading
+import time
+
+from idempotency_key import utils
+from idempotency_key.exceptions import DeadlineExceededError
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
+
+class LocalDeadline(object):
+    """
+    Stands in for the ContextVar on Python versions without contextvars. asgiref's Local, when django installs it,
+    keeps a separate deadline for each asyncio task as well as for each thread.
+    """
+
+    def __init__(self):
+        try:
+            from asgiref.local import Local
+        except ImportError:
+            Local = threading.local
+        self.local = Local()
+
+    def get(self):
+        return getattr(self.local, 'deadline', None)
+
+    def set(self, deadline):
+        token = self.get()
+        self.local.deadline = deadline
+        return token
+
+    def reset(self, token):
+        self.local.deadline = token
+
+
+# The time.monotonic() time by which the storage and lock calls in progress must finish, or None if there is no limit
+if ContextVar is not None:
+    _deadline = ContextVar('idempotency_key_deadline', default=None)
+else:
+    _deadline = LocalDeadline()
+
+
+@contextmanager
+def budget(request):
+    """
+    Limit the storage and lock calls made inside the block to the request's remaining time budget. The budget starts at
+    the DEADLINE_MS storage setting and the time spent inside each block is taken off it, so the lookup and the store
+    of a request share a single budget while the time spent in the view function is not counted.
+    """
+    remaining = getattr(request, 'idempotency_key_budget', utils.get_settings().storage_deadline)
+    if remaining is None:
+        yield
+        return
+
+    start = time.monotonic()
+    token = _deadline.set(start + remaining)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+        request.idempotency_key_budget = max(0.0, remaining - (time.monotonic() - start))
+
+
+def get_remaining():
+    """
+    Get the number of seconds left in the current budget, or None if there is no budget.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def get_timeout(timeout=None):
+    """
+    Get the timeout to use for a call that would otherwise use `timeout` seconds, which is the smaller of `timeout`
+    and the remaining budget. None means there is no limit.
+    """
+    remaining = get_remaining()
+    if remaining is None or (timeout is not None and timeout < remaining):
+        return timeout
+    return remaining
+
+
+def check():
+    """
+    Raise DeadlineExceededError if the budget has run out.
+    """
+    if get_remaining() == 0:
+        raise DeadlineExceededError()
+
+
+async def wait_for(awaitable):
+    """
+    Await a storage call, giving up with DeadlineExceededError when the budget runs out.
+    """
+    remaining = get_remaining()
+    if remaining is None:
+        return await awaitable
+
+    if remaining == 0:
+        # Close the coroutine that will never be awaited
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceededError()
+
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceededError() from None
@@ -1,7 +1,5 @@
 from functools import wraps
 
-from idempotency_key import utils
-
 
 # NOTE:
 # The following decorators must be specified BEFORE the @api_view decorator or the function will not be marked
@@ -36,8 +34,9 @@ def idempotency_key(*args, cache_name=None):
         wrapped_view.idempotency_key = True
 
         if cache_name:
+            # The cache name is validated by the idempotency_key system check, or by the middleware when the app is not
+            # installed
             wrapped_view.idempotency_key_cache_name = cache_name
-            utils.get_storage_class().validate_storage(cache_name)
 
         return wrapped_view
 
@@ -1,6 +1,13 @@
 import abc
+import base64
+import functools
 import hashlib
+import tempfile
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from idempotency_key import utils
 from idempotency_key.exceptions import MissingIdempotencyKeyError
 
 
@@ -9,15 +16,120 @@ class IdempotencyKeyEncoder(object):
     def encode_key(self, request, key):
         raise NotImplementedError
 
+    async def aencode_key(self, request, key):
+        """
+        Async version of encode_key used when the middleware is running under ASGI. The request body has already been
+        read by the time the view is called so by default encode_key is called directly.
+        """
+        return self.encode_key(request, key)
+
+
+def get_hash_constructor(algorithm: str, digest_size: int = None):
+    """
+    Get a function that creates a new hash object for the algorithm. Any algorithm supported by hashlib can be used, and
+    the xxhash algorithms (for example 'xxh3_64' or 'xxh3_128') if the xxhash package is installed.
+    :param algorithm: The name of the hash algorithm
+    :param digest_size: The digest size in bytes. Only supported by the blake2b and blake2s algorithms.
+    :return: a function that takes no arguments and returns a new hash object
+    """
+    if digest_size is not None:
+        if algorithm not in ('blake2b', 'blake2s'):
+            raise ImproperlyConfigured(
+                'ENCODER_DIGEST_SIZE is only supported by the blake2b and blake2s algorithms, not "{}".'.format(algorithm)
+            )
+        return functools.partial(getattr(hashlib, algorithm), digest_size=digest_size)
+
+    if algorithm.startswith('xxh'):
+        try:
+            import xxhash
+        except ImportError:
+            raise ImproperlyConfigured('The xxhash package must be installed to use the "{}" algorithm.'.format(algorithm))
+
+        constructor = getattr(xxhash, algorithm, None)
+    elif algorithm in hashlib.algorithms_available:
+        constructor = getattr(hashlib, algorithm, None) or functools.partial(hashlib.new, algorithm)
+    else:
+        constructor = None
+
+    if constructor is None:
+        raise ImproperlyConfigured('Unknown ENCODER_ALGORITHM "{}".'.format(algorithm))
+    return constructor
+
+
+def _base64url_digest(m):
+    return base64.urlsafe_b64encode(m.digest()).rstrip(b'=').decode('ascii')
+
+
+DIGEST_OUTPUTS = {
+    'hex': lambda m: m.hexdigest(),
+    'base64url': _base64url_digest,
+    'raw': lambda m: m.digest(),
+}
+
 
 class BasicKeyEncoder(IdempotencyKeyEncoder):
+    """
+    Generates the encoded key by hashing the idempotency key, the path, the method and the body of the request. The hash
+    algorithm and the form of the encoded key are set by the ENCODER_ALGORITHM, ENCODER_DIGEST_SIZE and ENCODER_OUTPUT
+    settings.
+    """
+
+    def __init__(self):
+        self.new_hash = get_hash_constructor(utils.get_encoder_algorithm(), utils.get_encoder_digest_size())
+        # Create a hash straight away so that invalid arguments, such as an out of range digest size, are reported when
+        # the encoder is created instead of on every request
+        try:
+            self.new_hash()
+        except (TypeError, ValueError) as e:
+            raise ImproperlyConfigured('Invalid ENCODER_ALGORITHM or ENCODER_DIGEST_SIZE: {}'.format(e))
+
+        output = utils.get_encoder_output()
+        self.get_digest = DIGEST_OUTPUTS.get(output)
+        if self.get_digest is None:
+            raise ImproperlyConfigured('Unknown ENCODER_OUTPUT "{}".'.format(output))
+
     def encode_key(self, request, key):
         if key is None:
             raise MissingIdempotencyKeyError()
-        # Basic method for generating an encoded key
-        m = hashlib.sha256()
+        m = self.start_hash(request, key)
+        m.update(request.body)
+        return self.get_digest(m)
+
+    def start_hash(self, request, key):
+        # Basic method for generating an encoded key. Everything except the request body is added here.
+        m = self.new_hash()
         m.update(key.encode('UTF-8'))
         m.update(request.path_info.encode('UTF-8'))
         m.update(request.method.encode('UTF-8'))
-        m.update(request.body)
-        return m.hexdigest()
+        return m
+
+
+class StreamingKeyEncoder(BasicKeyEncoder):
+    """
+    Generates the same keys as BasicKeyEncoder but does not load the whole request body into memory with request.body.
+    Instead the body is hashed in chunks of ENCODER_CHUNK_SIZE bytes as it is read from the request's input stream and
+    copied to a temporary file, which is only kept in memory while it is smaller than FILE_UPLOAD_MAX_MEMORY_SIZE. The
+    request then reads from the copy so the view can still stream the body or parse uploaded files.
+    """
+
+    def encode_key(self, request, key):
+        if key is None:
+            raise MissingIdempotencyKeyError()
+        m = self.start_hash(request, key)
+
+        # If the body has already been read then it can only be hashed from request.body
+        stream = getattr(request, '_stream', None)
+        if stream is None or hasattr(request, '_body') or getattr(request, '_read_started', False):
+            m.update(request.body)
+            return self.get_digest(m)
+
+        chunk_size = utils.get_encoder_chunk_size()
+        body_copy = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            m.update(chunk)
+            body_copy.write(chunk)
+
+        body_copy.seek(0)
+        request._stream = body_copy
+        request._read_started = False
+        return self.get_digest(m)
@@ -20,6 +20,17 @@ class DecoratorsMutuallyExclusiveError(Exception):
     pass
 
 
+class DeadlineExceededError(Exception):
+    """
+    Raised when the storage and lock calls for a request run out of the time given by the DEADLINE_MS storage setting
+    """
+
+    def __init__(self, msg=None):
+        if msg is None:
+            msg = 'The idempotency key storage deadline was exceeded.'
+        super().__init__(msg)
+
+
 def bad_request(request, exception, *args, **kwargs):
     """
     Generic 400 error handler.
@@ -38,3 +49,13 @@ def resource_locked(request, exception, *args, **kwargs):
         'error': 'Resource Locked (423)'
     }
     return JsonResponse(data, status=status.HTTP_423_LOCKED)
+
+
+def service_unavailable(request, exception, *args, **kwargs):
+    """
+    Generic 503 error handler.
+    """
+    data = {
+        'error': 'Service Unavailable (503)'
+    }
+    return JsonResponse(data, status=status.HTTP_503_SERVICE_UNAVAILABLE)
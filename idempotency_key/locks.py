@@ -1,54 +1,216 @@
 import abc
+import asyncio
 import threading
+import time
+import zlib
 
-from redis import Redis
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # django < 3.0, which cannot call the async methods, does not install asgiref
+    sync_to_async = None
 
+from idempotency_key import connections
+from idempotency_key import deadlines
 from idempotency_key import utils
 
 
 class IdempotencyKeyLock(abc.ABC):
+    # Set to True if acquire and release take the encoded key as their first argument. Locks written for the original
+    # release(self) signature are called without it.
+    accepts_key = False
+
     @abc.abstractmethod
     def acquire(self, *args, **kwargs) -> bool:
         raise NotImplementedError()
 
     @abc.abstractmethod
-    def release(self):
+    def release(self, *args, **kwargs):
         raise NotImplementedError()
 
+    async def aacquire(self, *args, **kwargs) -> bool:
+        """
+        Async version of acquire used when the middleware is running under ASGI. By default acquire is run in a thread
+        so that waiting for the lock does not block the event loop.
+        """
+        return await sync_to_async(self.acquire)(*args, **kwargs)
+
+    async def arelease(self, *args, **kwargs):
+        """
+        Async version of release.
+        """
+        await sync_to_async(self.release)(*args, **kwargs)
+
+
+async def acquire_thread_lock(lock, timeout) -> bool:
+    """
+    Acquire a threading lock from a coroutine without blocking the event loop. The lock is shared with requests handled
+    by threads so an asyncio.Lock cannot be used. Instead the lock is tried without blocking and, while it is held, tried
+    again after a short and increasing delay until the timeout in seconds runs out. A timeout of None waits forever.
+    """
+    if lock.acquire(blocking=False):
+        return True
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        if deadline is None:
+            await asyncio.sleep(delay)
+        else:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(delay, remaining))
+
+        if lock.acquire(blocking=False):
+            return True
+
+        delay = min(delay * 2, 0.01)
+
 
 class ThreadLock(IdempotencyKeyLock):
     """
     Should be used only when there is one process sharing the storage class resource.
     This uses the built-in python threading module to protect a resource.
     """
+
+    accepts_key = True
     storage_lock = threading.Lock()
 
     def acquire(self, *args, **kwargs) -> bool:
-        return self.storage_lock.acquire(blocking=True, timeout=utils.get_lock_timeout())
+        return self.storage_lock.acquire(blocking=True, timeout=deadlines.get_timeout(utils.get_lock_timeout()))
+
+    def release(self, *args, **kwargs):
+        self.storage_lock.release()
+
+    async def aacquire(self, *args, **kwargs) -> bool:
+        return await acquire_thread_lock(self.storage_lock, deadlines.get_timeout(utils.get_lock_timeout()))
 
-    def release(self):
+    async def arelease(self, *args, **kwargs):
         self.storage_lock.release()
 
 
+class StripedThreadLock(IdempotencyKeyLock):
+    """
+    Should be used only when there is one process sharing the storage class resource.
+    Instead of a single lock for every request, the encoded key is mapped onto one of a fixed number of lock stripes so
+    that requests using unrelated idempotency keys rarely have to wait for each other.
+    """
+
+    accepts_key = True
+
+    def __init__(self):
+        self.storage_locks = [threading.Lock() for _ in range(utils.get_lock_stripes())]
+
+    def get_storage_lock(self, encoded_key=None):
+        if encoded_key is None:
+            return self.storage_locks[0]
+
+        if isinstance(encoded_key, str):
+            encoded_key = encoded_key.encode('UTF-8')
+
+        return self.storage_locks[zlib.crc32(encoded_key) % len(self.storage_locks)]
+
+    def acquire(self, encoded_key=None, *args, **kwargs) -> bool:
+        return self.get_storage_lock(encoded_key).acquire(
+            blocking=True, timeout=deadlines.get_timeout(utils.get_lock_timeout())
+        )
+
+    def release(self, encoded_key=None, *args, **kwargs):
+        self.get_storage_lock(encoded_key).release()
+
+    async def aacquire(self, encoded_key=None, *args, **kwargs) -> bool:
+        return await acquire_thread_lock(
+            self.get_storage_lock(encoded_key), deadlines.get_timeout(utils.get_lock_timeout())
+        )
+
+    async def arelease(self, encoded_key=None, *args, **kwargs):
+        self.get_storage_lock(encoded_key).release()
+
+
 class MultiProcessRedisLock(IdempotencyKeyLock):
     """
     Should be used if a lock is required across processes. Not that this class uses Redis in order to perform the lock.
+    If the PER_KEY lock setting is True then a separate Redis lock is used for each encoded key so that only requests
+    using the same idempotency key contend with each other.
     """
 
+    accepts_key = True
+
     def __init__(self):
         location = utils.get_lock_location()
         if location is None or location == '':
             raise ValueError('Redis server location must be set in the settings file.')
 
-        self.redis_obj = Redis.from_url(location)
-        self.storage_lock = self.redis_obj.lock(
-            name=utils.get_lock_name(),
+        self.location = location
+        self.max_connections = utils.get_lock_max_connections()
+        self.django_redis_cache = utils.get_lock_django_redis_cache()
+        self.redis_obj = connections.get_redis_connection(location, self.max_connections, self.django_redis_cache)
+        self.per_key = utils.get_lock_per_key()
+        self.key_prefix = utils.get_lock_key_prefix()
+        self.name = utils.get_lock_name()
+        self.storage_lock = self._create_lock(self.name)
+
+        # Per-key locks that are currently held by this instance
+        self.storage_locks = dict()
+
+        # Async locks that are currently held by this instance keyed by lock name
+        self.async_storage_locks = dict()
+
+    def _create_lock(self, name, redis_obj=None, **kwargs):
+        return (redis_obj or self.redis_obj).lock(
+            name=name,
             timeout=utils.get_lock_time_to_live(),  # Time before lock is forcefully released.
             blocking_timeout=utils.get_lock_timeout(),
+            **kwargs
         )
 
-    def acquire(self, *args, **kwargs) -> bool:
-        return self.storage_lock.acquire()
+    def _get_lock_name(self, encoded_key=None):
+        if not self.per_key or encoded_key is None:
+            return self.name
 
-    def release(self):
-        self.storage_lock.release()
+        # Encoded keys are bytes when the ENCODER_OUTPUT setting is 'raw'
+        if isinstance(encoded_key, bytes):
+            return self.key_prefix.encode('UTF-8') + encoded_key
+
+        return '{}{}'.format(self.key_prefix, encoded_key)
+
+    def acquire(self, encoded_key=None, *args, **kwargs) -> bool:
+        # Stop waiting for the lock when the request's storage deadline runs out
+        blocking_timeout = deadlines.get_timeout(utils.get_lock_timeout())
+        if not self.per_key or encoded_key is None:
+            return self.storage_lock.acquire(blocking_timeout=blocking_timeout)
+
+        storage_lock = self._create_lock(self._get_lock_name(encoded_key))
+        if not storage_lock.acquire(blocking_timeout=blocking_timeout):
+            return False
+
+        self.storage_locks[encoded_key] = storage_lock
+        return True
+
+    def release(self, encoded_key=None, *args, **kwargs):
+        if not self.per_key or encoded_key is None:
+            self.storage_lock.release()
+            return
+
+        # Remove the lock before releasing it so that another thread acquiring the same key cannot be dropped.
+        self.storage_locks.pop(encoded_key).release()
+
+    async def aacquire(self, encoded_key=None, *args, **kwargs) -> bool:
+        if self.django_redis_cache:
+            return await super().aacquire(encoded_key, *args, **kwargs)
+
+        # A new lock is used for every acquire because coroutines on the same thread cannot share a thread local token
+        name = self._get_lock_name(encoded_key)
+        redis_obj = connections.get_async_redis_connection(self.location, self.max_connections)
+        storage_lock = self._create_lock(name, redis_obj, thread_local=False)
+        if not await storage_lock.acquire(blocking_timeout=deadlines.get_timeout(utils.get_lock_timeout())):
+            return False
+
+        self.async_storage_locks[name] = storage_lock
+        return True
+
+    async def arelease(self, encoded_key=None, *args, **kwargs):
+        if self.django_redis_cache:
+            return await super().arelease(encoded_key, *args, **kwargs)
+
+        await self.async_storage_locks.pop(self._get_lock_name(encoded_key)).release()
@@ -1,13 +1,50 @@
+import asyncio
+import copy
+import functools
 import logging
+import threading
+import time
+import weakref
 
+from django.apps import apps
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
+
+from idempotency_key import checks
+from idempotency_key import deadlines
 from idempotency_key import status
 from idempotency_key import utils
-from idempotency_key.exceptions import DecoratorsMutuallyExclusiveError, bad_request, resource_locked
+from idempotency_key.circuit_breaker import CircuitBreaker
+from idempotency_key.exceptions import (
+    DeadlineExceededError, DecoratorsMutuallyExclusiveError, bad_request, resource_locked, service_unavailable,
+)
+from idempotency_key.storage import IN_FLIGHT, WriteBehindKeyStorage
 
 logger = logging.getLogger('django-idempotency-key.idempotency_key.middleware')
 
+# Methods defined as 'safe' by RFC7231
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'TRACE'))
+
+SUCCESSFUL_STATUSES = frozenset((
+    status.HTTP_200_OK,
+    status.HTTP_201_CREATED,
+    status.HTTP_202_ACCEPTED,
+    status.HTTP_203_NON_AUTHORITATIVE_INFORMATION,
+    status.HTTP_204_NO_CONTENT,
+    status.HTTP_205_RESET_CONTENT,
+    status.HTTP_206_PARTIAL_CONTENT,
+    status.HTTP_207_MULTI_STATUS,
+))
+
 
 class IdempotencyKeyMiddleware:
     """
@@ -16,18 +53,72 @@ class IdempotencyKeyMiddleware:
     View functions can opt-out using the @idempotency_key_exempt decorator
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response=None):
         self.get_response = get_response
+        if get_response is not None and iscoroutinefunction(get_response):
+            # Running under ASGI so let django await the middleware and its process_view function directly
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+
+        # Without the app in INSTALLED_APPS the system check does not run, so check the settings here instead
+        if not apps.is_installed('idempotency_key'):
+            checks.validate_settings()
+
         self.storage = utils.get_storage_class()()
+        if utils.get_storage_write_behind():
+            self.storage = WriteBehindKeyStorage(
+                self.storage,
+                queue_size=utils.get_storage_write_behind_queue_size(),
+                flush_timeout=utils.get_storage_write_behind_flush_timeout(),
+            )
         self.encoder = utils.get_encoder_class()()
         self.storage_lock = utils.get_lock_class()()
 
+        # The (exempt, manual, cache_name) flags for each view function, keyed by the view function and request method
+        self.callback_flags = weakref.WeakKeyDictionary()
+
+        # Events used to wake up coalesced duplicates waiting on a request in this process, keyed by
+        # (cache_name, encoded_key)
+        self.in_flight_events = dict()
+        self.in_flight_events_lock = threading.Lock()
+
+        # Stops using the storage and lock while they are failing or too slow. See CircuitBreaker.
+        self.circuit_breaker = None
+        self.circuit_breaker_fail_open = utils.get_circuit_breaker_mode() == 'fail-open'
+        if utils.get_circuit_breaker_enable():
+            self.circuit_breaker = CircuitBreaker(
+                window=utils.get_circuit_breaker_window(),
+                min_calls=utils.get_circuit_breaker_min_calls(),
+                failure_rate=utils.get_circuit_breaker_failure_rate(),
+                slow_call_duration=utils.get_circuit_breaker_slow_call_duration(),
+                reset_timeout=utils.get_circuit_breaker_reset_timeout(),
+            )
+
+        # The (callback, [(request, response), ...]) registered with on_commit for each database connection that has
+        # responses waiting for its transaction to commit. See defer_store.
+        self.store_on_commit = utils.get_storage_store_on_commit()
+        self.store_on_commit_database = utils.get_storage_store_on_commit_database()
+        self.commit_batches = weakref.WeakKeyDictionary()
+        self.commit_batches_lock = threading.Lock()
+
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         self.process_request(request)
         response = self.get_response(request)
         response = self.process_response(request, response)
         return response
 
+    async def __acall__(self, request):
+        self.process_request(request)
+        response = await self.get_response(request)
+        response = await self.aprocess_response(request, response)
+        return response
+
     @staticmethod
     def _reject(request, reason):
         response = bad_request(request, None)
@@ -40,7 +131,11 @@ class IdempotencyKeyMiddleware:
         )
         return response
 
-    def _set_flags_from_callback(self, request, callback):
+    def _get_flags_from_callback(self, request, callback):
+        """
+        Get the (exempt, manual, cache_name) flags for the view function and request method. cache_name is None if the
+        view function does not specify one.
+        """
         # If there is an actions attribute then the function is wrapped in a DRF viewset
         func_name = callback.__name__
         if hasattr(callback, 'actions'):
@@ -51,7 +146,7 @@ class IdempotencyKeyMiddleware:
         idempotency_key = getattr(callback, 'idempotency_key', None)
         idempotency_key_exempt = getattr(callback, 'idempotency_key_exempt', False)
         idempotency_key_manual = getattr(callback, 'idempotency_key_manual', False)
-        idempotency_key_cache_name = getattr(callback, 'idempotency_key_cache_name', utils.get_storage_cache_name())
+        idempotency_key_cache_name = getattr(callback, 'idempotency_key_cache_name', None)
 
         if idempotency_key and idempotency_key_exempt:
             raise DecoratorsMutuallyExclusiveError(
@@ -63,14 +158,70 @@ class IdempotencyKeyMiddleware:
                 '@idempotency_key_manual and @idempotency_key_exempt decorators are mutually exclusive for '
                 'function "{}"'.format(func_name))
 
+        return idempotency_key_exempt, idempotency_key_manual, idempotency_key_cache_name
+
+    def _set_flags_from_callback(self, request, callback):
+        # The flags only depend on the view function and the request method so they are resolved once and cached.
+        try:
+            callback_flags = self.callback_flags.setdefault(callback, dict())
+        except TypeError:
+            # The view function cannot be weakly referenced so the flags cannot be cached
+            callback_flags = dict()
+
+        flags = callback_flags.get(request.method)
+        if flags is None:
+            flags = callback_flags[request.method] = self._get_flags_from_callback(request, callback)
+
+        idempotency_key_exempt, idempotency_key_manual, idempotency_key_cache_name = flags
+
         request.idempotency_key_exempt = idempotency_key_exempt
         request.idempotency_key_manual = idempotency_key_manual
-        request.idempotency_key_cache_name = idempotency_key_cache_name
+        request.idempotency_key_cache_name = idempotency_key_cache_name or utils.get_settings().storage_cache_name
 
     def perform_generate_response(self, request, encoded_key):
-        # Check if a response already exists for the encoded key
-        key_exists, response = self.storage.retrieve_data(request.idempotency_key_cache_name, encoded_key)
+        cache_name = request.idempotency_key_cache_name
+
+        if utils.get_settings().storage_in_flight_reservation:
+            # Check if a response already exists for the encoded key and if not then reserve the key so that any
+            # duplicates arriving before the response is stored can be detected
+            deadlines.check()
+            key_exists, response = self.storage.retrieve_or_reserve(cache_name, encoded_key)
+            if not key_exists:
+                self.mark_reserved(request, encoded_key)
+        else:
+            # Check if a response already exists for the encoded key
+            deadlines.check()
+            key_exists, response = self.storage.retrieve_data(cache_name, encoded_key)
+
+        return self.perform_lookup_response(request, key_exists, response)
+
+    async def aperform_generate_response(self, request, encoded_key):
+        cache_name = request.idempotency_key_cache_name
+
+        if utils.get_settings().storage_in_flight_reservation:
+            key_exists, response = await deadlines.wait_for(self.storage.aretrieve_or_reserve(cache_name, encoded_key))
+            if not key_exists:
+                self.mark_reserved(request, encoded_key)
+        else:
+            key_exists, response = await deadlines.wait_for(self.storage.aretrieve_data(cache_name, encoded_key))
+
+        return self.perform_lookup_response(request, key_exists, response)
+
+    def mark_reserved(self, request, encoded_key):
+        request.idempotency_key_reserved = True
+        if utils.get_settings().storage_coalesce:
+            with self.in_flight_events_lock:
+                self.in_flight_events[(request.idempotency_key_cache_name, encoded_key)] = threading.Event()
+
+    def perform_lookup_response(self, request, key_exists, response):
+        # If another request using the same key is still being processed then do not run the view again
+        if key_exists and response is IN_FLIGHT:
+            request.idempotency_key_in_flight = True
+            return resource_locked(request, None)
+
+        return self.perform_replay(request, key_exists, response)
 
+    def perform_replay(self, request, key_exists, response):
         # add the key exists result and the original request if it exists
         request.idempotency_key_exists = key_exists
         request.idempotency_key_response = response
@@ -78,7 +229,7 @@ class IdempotencyKeyMiddleware:
         # If not manual override and the key already exists
         if not request.idempotency_key_manual and key_exists:
             # Get the required return status code from settings
-            status_code = utils.get_conflict_code()
+            status_code = utils.get_settings().conflict_code
             # if None then return whatever the status code was originally otherwise use the specified status code
             if status_code is not None:
                 response.status_code = status_code
@@ -86,21 +237,240 @@ class IdempotencyKeyMiddleware:
 
         return None
 
-    def generate_response(self, request, encoded_key, lock=None):
-        if lock is None:
-            lock = utils.get_lock_enable()
+    def wait_for_response(self, request, encoded_key, locked_response):
+        """
+        Wait for the request that reserved the key to store its response and then replay it. Duplicates of a request
+        running in this process are woken up by an event, otherwise the storage is polled with a bounded backoff.
+        If the response is not stored in time, or the reservation is released without storing a response, then the
+        original HTTP_423_LOCKED response is returned.
+        """
+        cache_name = request.idempotency_key_cache_name
+        deadline = time.monotonic() + utils.get_settings().storage_coalesce_timeout
+        event = self.in_flight_events.get((cache_name, encoded_key))
+        delay = 0.005
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return locked_response
+
+            if event is not None:
+                event.wait(remaining)
+                event = None
+            else:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.1)
+
+            called, result = self.call_storage(request, self.storage.retrieve_data, cache_name, encoded_key)
+            if not called:
+                return result
+
+            key_exists, response = result
+            if not key_exists or response is not IN_FLIGHT:
+                return self.perform_waited_response(request, key_exists, response, locked_response)
+
+    async def await_response(self, request, encoded_key, locked_response):
+        """
+        Async version of wait_for_response. The event loop cannot block on the event so the storage is always polled
+        with a bounded backoff, but while the original request in this process has not finished the storage is skipped.
+        """
+        cache_name = request.idempotency_key_cache_name
+        deadline = time.monotonic() + utils.get_settings().storage_coalesce_timeout
+        event = self.in_flight_events.get((cache_name, encoded_key))
+        delay = 0.005
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return locked_response
+
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+            if event is not None and not event.is_set():
+                continue
+
+            called, result = await self.acall_storage(
+                request, lambda: deadlines.wait_for(self.storage.aretrieve_data(cache_name, encoded_key))
+            )
+            if not called:
+                return result
+
+            key_exists, response = result
+            if not key_exists or response is not IN_FLIGHT:
+                return self.perform_waited_response(request, key_exists, response, locked_response)
+
+    def perform_waited_response(self, request, key_exists, response, locked_response):
+        # The reservation was released without a response being stored
+        if not key_exists:
+            return locked_response
+
+        request.idempotency_key_in_flight = False
+        # The storage may hand back the very object the original request is still returning, so copy it before the
+        # status code is changed.
+        return self.perform_replay(request, key_exists, copy.copy(response))
+
+    def notify_waiters(self, request):
+        # Wake up any coalesced duplicates in this process that are waiting for this request's response.
+        with self.in_flight_events_lock:
+            event = self.in_flight_events.pop(
+                (request.idempotency_key_cache_name, request.idempotency_key_encoded_key), None
+            )
+        if event is not None:
+            event.set()
+
+    def release_reservation(self, request):
+        # Remove the in-flight reservation if one was made for this request and no response is going to be stored.
+        if getattr(request, 'idempotency_key_reserved', False):
+            deadlines.check()
+            self.storage.release_key(request.idempotency_key_cache_name, request.idempotency_key_encoded_key)
+            request.idempotency_key_reserved = False
+            self.notify_waiters(request)
+
+    async def arelease_reservation(self, request):
+        if getattr(request, 'idempotency_key_reserved', False):
+            await deadlines.wait_for(
+                self.storage.arelease_key(request.idempotency_key_cache_name, request.idempotency_key_encoded_key)
+            )
+            request.idempotency_key_reserved = False
+            self.notify_waiters(request)
+
+    def requires_lock(self):
+        idempotency_key_settings = utils.get_settings()
+        # A lock is not needed if the storage can check and reserve the key in a single atomic operation
+        return idempotency_key_settings.lock_enable and not (
+            idempotency_key_settings.storage_in_flight_reservation and
+            getattr(self.storage, 'atomic_reservation', False)
+        )
 
+    def circuit_broken(self, request):
+        """
+        The response used while the circuit breaker is open or when the storage or lock fails. When failing open the
+        view function is called without the protection of the idempotency key and its response is not stored.
+        """
+        if not self.circuit_breaker_fail_open:
+            return service_unavailable(request, None)
+
+        request.idempotency_key_bypassed = True
+        self.circuit_breaker.record_bypass()
+        logger.warning(
+            'Idempotency key storage is unavailable, request passed through without idempotency: %s', request.path
+        )
+        return None
+
+    def deadline_exceeded(self, request):
+        # The storage is too slow to tell whether the request is a duplicate so do not call the view function
+        logger.warning('Idempotency key lookup exceeded the storage deadline: %s', request.path)
+        return service_unavailable(request, None)
+
+    def get_lock_args(self, encoded_key):
+        # Only pass the encoded key to locks that take it, see IdempotencyKeyLock.accepts_key
+        return (encoded_key,) if getattr(self.storage_lock, 'accepts_key', False) else ()
+
+    def lookup_response(self, request, encoded_key, lock):
         if not lock:
             return self.perform_generate_response(request, encoded_key)
 
         # If there was a timeout for a lock on the storage object then return a HTTP_423_LOCKED
-        if not self.storage_lock.acquire():
+        lock_args = self.get_lock_args(encoded_key)
+        if not self.storage_lock.acquire(*lock_args):
             return resource_locked(request, None)
 
         try:
             return self.perform_generate_response(request, encoded_key)
         finally:
-            self.storage_lock.release()
+            self.storage_lock.release(*lock_args)
+
+    async def alookup_response(self, request, encoded_key, lock):
+        if not lock:
+            return await self.aperform_generate_response(request, encoded_key)
+
+        lock_args = self.get_lock_args(encoded_key)
+        if not await self.storage_lock.aacquire(*lock_args):
+            return resource_locked(request, None)
+
+        try:
+            return await self.aperform_generate_response(request, encoded_key)
+        finally:
+            await self.storage_lock.arelease(*lock_args)
+
+    def call_storage(self, request, func, *args):
+        """
+        Call a function that uses the storage or lock while looking up a request. The call shares the request's
+        DEADLINE_MS budget with storing the response and is recorded by the circuit breaker. Returns (True, result) if
+        the call succeeded, otherwise (False, response) where response is what the middleware returns instead.
+        """
+        if self.circuit_breaker is None:
+            try:
+                with deadlines.budget(request):
+                    return True, func(*args)
+            except DeadlineExceededError:
+                return False, self.deadline_exceeded(request)
+
+        if not self.circuit_breaker.allow_request():
+            return False, self.circuit_broken(request)
+
+        start = time.monotonic()
+        try:
+            with deadlines.budget(request):
+                result = func(*args)
+        except Exception:
+            self.circuit_breaker.record(time.monotonic() - start, failed=True)
+            logger.exception('Idempotency key lookup failed: %s', request.path)
+            return False, self.circuit_broken(request)
+        self.circuit_breaker.record(time.monotonic() - start)
+        return True, result
+
+    async def acall_storage(self, request, func, *args):
+        """
+        Async version of call_storage, where func returns an awaitable.
+        """
+        if self.circuit_breaker is None:
+            try:
+                with deadlines.budget(request):
+                    return True, await func(*args)
+            except DeadlineExceededError:
+                return False, self.deadline_exceeded(request)
+
+        if not self.circuit_breaker.allow_request():
+            return False, self.circuit_broken(request)
+
+        start = time.monotonic()
+        try:
+            with deadlines.budget(request):
+                result = await func(*args)
+        except Exception:
+            self.circuit_breaker.record(time.monotonic() - start, failed=True)
+            logger.exception('Idempotency key lookup failed: %s', request.path)
+            return False, self.circuit_broken(request)
+        self.circuit_breaker.record(time.monotonic() - start)
+        return True, result
+
+    def generate_response(self, request, encoded_key, lock=None):
+        if lock is None:
+            lock = self.requires_lock()
+
+        called, response = self.call_storage(request, self.lookup_response, request, encoded_key, lock)
+        if not called:
+            return response
+
+        # Wait for the duplicate request outside of the lock so other keys are not held up
+        if getattr(request, 'idempotency_key_in_flight', False) and utils.get_settings().storage_coalesce:
+            return self.wait_for_response(request, encoded_key, response)
+
+        return response
+
+    async def agenerate_response(self, request, encoded_key, lock=None):
+        if lock is None:
+            lock = self.requires_lock()
+
+        called, response = await self.acall_storage(request, self.alookup_response, request, encoded_key, lock)
+        if not called:
+            return response
+
+        if getattr(request, 'idempotency_key_in_flight', False) and utils.get_settings().storage_coalesce:
+            return await self.await_response(request, encoded_key, response)
+
+        return response
 
     def process_request(self, request):
         key = request.META.get('HTTP_IDEMPOTENCY_KEY')
@@ -110,21 +480,35 @@ class IdempotencyKeyMiddleware:
         # Use this attribute to check that process_view has been called.
         request.idempotency_key_done = False
 
-    def process_view(self, request, callback, callback_args, callback_kwargs):
+    def get_idempotency_key(self, request, callback):
+        """
+        Set the flags for the view function on the request and get the idempotency key from the header. Returns None if
+        the view function is exempt.
+        """
         self._set_flags_from_callback(request, callback)
 
         # signal the process_view has been called
         request.idempotency_key_done = True
 
         # Assume that anything defined as 'safe' by RFC7231 is exempt or if exempt is specified directly
-        if request.idempotency_key_exempt or request.method in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+        if request.idempotency_key_exempt or request.method in SAFE_METHODS:
             request.idempotency_key_exempt = True
             return None
 
         # At this point the view function is not exempt so mark it as such
         request.idempotency_key_exempt = False
 
-        key = request.META.get('IDEMPOTENCY_KEY')
+        return request.META.get('IDEMPOTENCY_KEY')
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # Release the keys of a rolled back transaction before they are looked up by a retry
+        if self.store_on_commit:
+            self.release_rolled_back_batch()
+
+        key = self.get_idempotency_key(request, callback)
+        if request.idempotency_key_exempt:
+            return None
+
         if key is None:
             return self._reject(request, 'Idempotency key is required and was not specified in the header.')
 
@@ -134,20 +518,26 @@ class IdempotencyKeyMiddleware:
         # Generate the response
         return self.generate_response(request, encoded_key)
 
-    def process_response(self, request, response):
-        # If the response is not in the 20X range then return the response because at this point protecting it with an
+    async def aprocess_view(self, request, callback, callback_args, callback_kwargs):
+        key = self.get_idempotency_key(request, callback)
+        if request.idempotency_key_exempt:
+            return None
+
+        if key is None:
+            return self._reject(request, 'Idempotency key is required and was not specified in the header.')
+
+        encoded_key = request.idempotency_key_encoded_key = await self.encoder.aencode_key(request, key)
+
+        return await self.agenerate_response(request, encoded_key)
+
+    def should_store(self, request, response):
+        """
+        Check whether the response should be stored for the request's idempotency key.
+        """
+        # If the response is not in the 20X range then do not store it because at this point protecting it with an
         # idempotency key is meaningless.
-        if response and response.status_code not in [
-            status.HTTP_200_OK,
-            status.HTTP_201_CREATED,
-            status.HTTP_202_ACCEPTED,
-            status.HTTP_203_NON_AUTHORITATIVE_INFORMATION,
-            status.HTTP_204_NO_CONTENT,
-            status.HTTP_205_RESET_CONTENT,
-            status.HTTP_206_PARTIAL_CONTENT,
-            status.HTTP_207_MULTI_STATUS,
-        ]:
-            return response
+        if response and response.status_code not in SUCCESSFUL_STATUSES:
+            return False
 
         # Make sure that process_view is called otherwise the use of idempotency keys will be overridden without us
         # knowing about it.
@@ -158,16 +548,152 @@ class IdempotencyKeyMiddleware:
                 'be properly protected with idempotency keys.'
             )
 
-        if getattr(request, 'idempotency_key_exempt', True):
-            return response
+        if getattr(request, 'idempotency_key_exempt', True) or request.method in SAFE_METHODS:
+            return False
+
+        # The storage was not used for the request because the circuit breaker is open
+        if getattr(request, 'idempotency_key_bypassed', False):
+            return False
+
+        # If the response matches that given by the store_on_statuses function then store the data
+        return response.status_code in utils.get_settings().storage_store_on_statuses
+
+    def perform_process_response(self, request, response, store):
+        with deadlines.budget(request):
+            if not store:
+                self.release_reservation(request)
+                return
+
+            deadlines.check()
+            self.storage.store_data(request.idempotency_key_cache_name, request.idempotency_key_encoded_key, response)
+        if getattr(request, 'idempotency_key_reserved', False):
+            self.notify_waiters(request)
+
+    async def aperform_process_response(self, request, response, store):
+        with deadlines.budget(request):
+            if not store:
+                await self.arelease_reservation(request)
+                return
+
+            await deadlines.wait_for(self.storage.astore_data(
+                request.idempotency_key_cache_name, request.idempotency_key_encoded_key, response
+            ))
+        if getattr(request, 'idempotency_key_reserved', False):
+            self.notify_waiters(request)
+
+    def storage_failed(self, request, start):
+        """
+        Record a failure to store or release the idempotency key. The response of the view function is still returned.
+        """
+        self.circuit_breaker.record(time.monotonic() - start, failed=True)
+        logger.exception('Failed to store the response for the idempotency key: %s', request.path)
+        self.notify_waiters(request)
+
+    def store_deadline_exceeded(self, request):
+        # The view function has already been called so its response is still returned
+        logger.warning('Idempotency key response was not stored within the storage deadline: %s', request.path)
+        self.notify_waiters(request)
+
+    def store_response(self, request, response, store):
+        # Only calls that use the storage are tracked by the circuit breaker
+        if self.circuit_breaker is None or not (store or getattr(request, 'idempotency_key_reserved', False)):
+            try:
+                self.perform_process_response(request, response, store)
+            except DeadlineExceededError:
+                self.store_deadline_exceeded(request)
+            return
+
+        start = time.monotonic()
+        try:
+            self.perform_process_response(request, response, store)
+        except Exception:
+            self.storage_failed(request, start)
+        else:
+            self.circuit_breaker.record(time.monotonic() - start)
+
+    def defer_store(self, request, response):
+        """
+        If STORE_ON_COMMIT is True and the response is being processed inside a transaction then store the response
+        once the transaction commits, along with every other response stored during the same transaction. Returns
+        False if the response should be stored straight away.
+        """
+        if not self.store_on_commit:
+            return False
+
+        connection = transaction.get_connection(self.store_on_commit_database)
+        if not connection.in_atomic_block:
+            return False
+
+        with self.commit_batches_lock:
+            callback, batch = self.commit_batches.get(connection, (None, None))
+            # Start a new batch if the callback of the previous one has been called or rolled back, see
+            # release_rolled_back_batch
+            if callback is None or not any(entry[1] is callback for entry in connection.run_on_commit):
+                batch = []
+                callback = functools.partial(self.store_batch, batch)
+                self.commit_batches[connection] = (callback, batch)
+                connection.on_commit(callback)
+            batch.append((request, response))
+
+        return True
+
+    def store_batch(self, batch):
+        # The transaction has already been committed so a failure to store a response must not be raised to the caller
+        for request, response in batch:
+            try:
+                self.store_response(request, response, True)
+            except Exception:
+                logger.exception('Failed to store the response for the idempotency key: %s', request.path)
+        del batch[:]
+
+    def release_rolled_back_batch(self):
+        """
+        Release the keys of the responses deferred by a transaction that has since been rolled back, so that the
+        requests can be retried and the duplicates waiting on them are woken up. The callback is removed from
+        run_on_commit when it is called or when the transaction is rolled back and store_batch empties the batch, so a
+        batch that still has entries once its callback is gone was rolled back. Django has no rollback hook, so this is
+        only noticed by the next request processed on the same thread's database connection.
+        """
+        connection = transaction.get_connection(self.store_on_commit_database)
+        with self.commit_batches_lock:
+            callback, batch = self.commit_batches.get(connection, (None, None))
+            if callback is None or any(entry[1] is callback for entry in connection.run_on_commit):
+                return
+
+            del self.commit_batches[connection]
+            rolled_back = list(batch)
+            del batch[:]
+
+        for request, response in rolled_back:
+            try:
+                self.store_response(request, response, False)
+            except Exception:
+                logger.exception('Failed to release the idempotency key: %s', request.path)
+
+    def process_response(self, request, response):
+        store = self.should_store(request, response)
+        if self.store_on_commit:
+            self.release_rolled_back_batch()
+        if not (store and self.defer_store(request, response)):
+            self.store_response(request, response, store)
+        return response
 
-        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
-            # If the response matches that given by the store_on_statuses function then store the data
-            if response.status_code in utils.get_storage_store_on_statuses():
-                self.storage.store_data(
-                    request.idempotency_key_cache_name, request.idempotency_key_encoded_key, response
-                )
+    async def aprocess_response(self, request, response):
+        store = self.should_store(request, response)
+        if self.circuit_breaker is None or not (store or getattr(request, 'idempotency_key_reserved', False)):
+            try:
+                await self.aperform_process_response(request, response, store)
+            except DeadlineExceededError:
+                self.store_deadline_exceeded(request)
+            return response
 
+        start = time.monotonic()
+        try:
+            await self.aperform_process_response(request, response, store)
+        except Exception:
+            self.storage_failed(request, start)
+        else:
+            self.circuit_breaker.record(time.monotonic() - start)
         return response
 
 
@@ -177,7 +703,7 @@ class ExemptIdempotencyKeyMiddleware(IdempotencyKeyMiddleware):
     View functions opt-in using the @idempotency_key or @idempotency_key_manual decorators.
     """
 
-    def _set_flags_from_callback(self, request, callback):
+    def _get_flags_from_callback(self, request, callback):
         func_name = callback.__name__
         # If there is an actions attribute then the function is wrapped in a DRF viewset
         if hasattr(callback, 'actions'):
@@ -193,7 +719,7 @@ class ExemptIdempotencyKeyMiddleware(IdempotencyKeyMiddleware):
         idempotency_key = getattr(callback, 'idempotency_key', False)
         idempotency_key_exempt = getattr(callback, 'idempotency_key_exempt', None)
         idempotency_key_manual = getattr(callback, 'idempotency_key_manual', False)
-        idempotency_key_cache_name = getattr(callback, 'idempotency_key_cache_name', utils.get_storage_cache_name())
+        idempotency_key_cache_name = getattr(callback, 'idempotency_key_cache_name', None)
 
         if idempotency_key and idempotency_key_exempt:
             raise DecoratorsMutuallyExclusiveError(
@@ -205,9 +731,8 @@ class ExemptIdempotencyKeyMiddleware(IdempotencyKeyMiddleware):
                 '@idempotency_key_manual and @idempotency_key_exempt decorators are mutually exclusive for '
                 'function "{}"'.format(func_name))
 
-        request.idempotency_key_exempt = idempotency_key_exempt or (
+        idempotency_key_exempt = idempotency_key_exempt or (
                 idempotency_key_exempt is None and not idempotency_key_manual and not idempotency_key
         )
 
-        request.idempotency_key_manual = idempotency_key_manual
-        request.idempotency_key_cache_name = idempotency_key_cache_name
+        return idempotency_key_exempt, idempotency_key_manual, idempotency_key_cache_name
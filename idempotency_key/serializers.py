@@ -0,0 +1,96 @@
+import abc
+import pickle
+import struct
+
+from django.http import HttpResponse
+
+
+class IdempotencyKeySerializer(object):
+    @abc.abstractmethod
+    def serialize(self, response: object) -> bytes:
+        """
+        Convert the response into bytes so that it can be stored.
+        :param response: The response object to serialize
+        :return: the serialized response
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def deserialize(self, data: bytes) -> object:
+        """
+        Convert bytes created by the serialize function back into a response object.
+        :param data: The serialized response
+        :return: the response object
+        """
+        raise NotImplementedError
+
+
+class PickleSerializer(IdempotencyKeySerializer):
+    """
+    Pickles the whole response object. Any object can be stored but the stored data includes everything the response
+    refers to such as the renderer, data and request objects for a DRF response.
+    """
+
+    def serialize(self, response: object) -> bytes:
+        return pickle.dumps(response)
+
+    def deserialize(self, data: bytes) -> object:
+        return pickle.loads(data)
+
+
+class CompactResponseSerializer(IdempotencyKeySerializer):
+    """
+    Stores only the status code, headers and rendered content of the response using the following binary layout:
+
+        version (1 byte), status code (2 bytes), header count (2 bytes),
+        for each header: name length (2 bytes), value length (4 bytes), name, value
+        content
+
+    All numbers are big endian and header names and values are UTF-8 encoded. Each cookie set on the response is stored
+    as a Set-Cookie header. Responses are replayed as an HttpResponse.
+    """
+    VERSION = 1
+
+    _prefix = struct.Struct('>BHH')
+    _header = struct.Struct('>HI')
+
+    def serialize(self, response: object) -> bytes:
+        if getattr(response, 'streaming', False):
+            raise ValueError('Streaming responses cannot be serialized.')
+
+        headers = list(response.items())
+        # Cookies are kept separately from the other headers by django
+        headers.extend(('Set-Cookie', cookie.OutputString()) for cookie in response.cookies.values())
+        parts = [self._prefix.pack(self.VERSION, response.status_code, len(headers))]
+        for name, value in headers:
+            name = name.encode('UTF-8')
+            value = value.encode('UTF-8')
+            parts.extend((self._header.pack(len(name), len(value)), name, value))
+        parts.append(response.content)
+        return b''.join(parts)
+
+    def deserialize(self, data: bytes) -> object:
+        version, status_code, header_count = self._prefix.unpack_from(data)
+        if version != self.VERSION:
+            raise ValueError('Unsupported serialized response version {}.'.format(version))
+
+        offset = self._prefix.size
+        headers = []
+        for _ in range(header_count):
+            name_length, value_length = self._header.unpack_from(data, offset)
+            offset += self._header.size
+            name = data[offset:offset + name_length].decode('UTF-8')
+            offset += name_length
+            value = data[offset:offset + value_length].decode('UTF-8')
+            offset += value_length
+            headers.append((name, value))
+
+        response = HttpResponse(data[offset:], status=status_code)
+        # Only use the headers from the original response
+        del response['Content-Type']
+        for name, value in headers:
+            if name == 'Set-Cookie':
+                response.cookies.load(value)
+            else:
+                response[name] = value
+        return response
@@ -1,12 +1,57 @@
 import abc
-from collections import defaultdict
-import pickle
+import atexit
+from collections import defaultdict, OrderedDict
+import copy
+import heapq
+from http.cookies import SimpleCookie
+import logging
+import sys
+import threading
+import time
 from typing import Tuple
+import weakref
 
 from django.core.cache import caches
 
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # django < 3.0, which cannot call the async methods, does not install asgiref
+    sync_to_async = None
+
+try:
+    from django.http.response import ResponseHeaders
+except ImportError:  # django < 3.2
+    ResponseHeaders = None
+
+from idempotency_key import connections
+from idempotency_key import utils
+
+logger = logging.getLogger('django-idempotency-key.idempotency_key.storage')
+
+# Value stored under an encoded key while the request that will produce its response is still being processed.
+IN_FLIGHT = b'idempotency_key:in-flight'
+
+# Default returned by the cache when a key is missing, so existence and retrieval can be done in a single call.
+_MISSING = object()
+
+
+def get_approximate_size(value: object) -> int:
+    """
+    Approximate the number of bytes used by a stored value. For responses only the content and headers are counted.
+    """
+    if isinstance(value, (bytes, str)):
+        return len(value)
+
+    content = getattr(value, 'content', None)
+    if isinstance(content, bytes):
+        return len(content) + sum(len(name) + len(header) for name, header in value.items())
+
+    return sys.getsizeof(value)
+
 
 class IdempotencyKeyStorage(object):
+    # Set to True if retrieve_or_reserve is atomic, in which case no lock is used around it by the middleware
+    atomic_reservation = False
 
     @abc.abstractmethod
     def store_data(self, cache_name: str, encoded_key: str, response: object) -> None:
@@ -29,6 +74,76 @@ class IdempotencyKeyStorage(object):
         """
         raise NotImplementedError
 
+    def reserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        """
+        Atomically mark the key as in flight if nothing is stored under it yet. While reserved, retrieve_data returns
+        IN_FLIGHT as the data for the key until store_data replaces it or release_key removes it.
+        Only needs to be implemented if the IN_FLIGHT_RESERVATION storage setting is used.
+        :param cache_name: The name of the cache to use defined in settings under CACHES
+        :param encoded_key: the key to reserve
+        :return: True if the reservation was made, False if the key already exists
+        """
+        raise NotImplementedError
+
+    def release_key(self, cache_name: str, encoded_key: str) -> None:
+        """
+        Remove a reservation made by reserve_key when no response will be stored for the key.
+        Only needs to be implemented if the IN_FLIGHT_RESERVATION storage setting is used.
+        :param cache_name: The name of the cache to use defined in settings under CACHES
+        :param encoded_key: the key that was reserved
+        :return: None
+        """
+        raise NotImplementedError
+
+    def retrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        """
+        Retrieve the data stored under the key, or reserve the key if nothing is stored under it yet. Storage classes
+        can override this to do both in a single operation.
+        :param cache_name: The name of the cache to use defined in settings under CACHES
+        :param encoded_key: The key that was used to store the response data
+        :return: the same as retrieve_data, where (False, None) means the key has been reserved for the caller
+        """
+        key_exists, response = self.retrieve_data(cache_name, encoded_key)
+        if key_exists:
+            return key_exists, response
+
+        # Another request reserved the key between the two calls
+        if not self.reserve_key(cache_name, encoded_key):
+            return True, IN_FLIGHT
+
+        return False, None
+
+    async def astore_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        """
+        Async version of store_data used when the middleware is running under ASGI. By default store_data is run in a
+        thread so that the event loop is not blocked. Storage classes that do not block can override the async methods.
+        """
+        await sync_to_async(self.store_data)(cache_name, encoded_key, response)
+
+    async def aretrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        """
+        Async version of retrieve_data.
+        """
+        return await sync_to_async(self.retrieve_data)(cache_name, encoded_key)
+
+    async def areserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        """
+        Async version of reserve_key.
+        """
+        return await sync_to_async(self.reserve_key)(cache_name, encoded_key)
+
+    async def arelease_key(self, cache_name: str, encoded_key: str) -> None:
+        """
+        Async version of release_key.
+        """
+        await sync_to_async(self.release_key)(cache_name, encoded_key)
+
+    async def aretrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        """
+        Async version of retrieve_or_reserve.
+        """
+        return await sync_to_async(self.retrieve_or_reserve)(cache_name, encoded_key)
+
     @staticmethod
     @abc.abstractmethod
     def validate_storage(name: str):
@@ -42,20 +157,155 @@ class IdempotencyKeyStorage(object):
 
 
 class MemoryKeyStorage(IdempotencyKeyStorage):
+    """
+    Stores the responses in the memory of the current process. Each cache name can be limited to a maximum number of
+    entries and/or an approximate number of bytes using the MEMORY_OPTIONS storage setting, in which case the least
+    recently used entries are removed first. In-flight reservations are never removed to make room.
+    Entries expire after the TIMEOUT given in MEMORY_OPTIONS, or the TIMEOUT of the cache with the same name under
+    CACHES if there is one. Expired entries are removed lazily using a heap ordered by expiry time.
+    """
 
-    def __init__(self):
-        self.idempotency_key_cache_data = defaultdict(dict)
+    def __init__(self, options: dict = None):
+        """
+        :param options: If specified then these options are used for every cache name instead of MEMORY_OPTIONS.
+        """
+        self.default_options = options
+        self.idempotency_key_cache_data = defaultdict(OrderedDict)
+        self.idempotency_key_cache_sizes = defaultdict(dict)
+        self.idempotency_key_cache_total_sizes = defaultdict(int)
+        self.idempotency_key_cache_expiry_times = defaultdict(dict)
+        self.idempotency_key_cache_expiry_heaps = defaultdict(list)
+        self.idempotency_key_cache_options = dict()
+        self.cache_lock = threading.Lock()
+
+    def get_cache_options(self, cache_name: str) -> dict:
+        options = self.idempotency_key_cache_options.get(cache_name)
+        if options is None:
+            if self.default_options is not None:
+                options = dict(self.default_options)
+            else:
+                options = dict(utils.get_storage_memory_options(cache_name))
+            options.setdefault('TIMEOUT', utils.get_storage_cache_timeout(cache_name))
+            self.idempotency_key_cache_options[cache_name] = options
+        return options
+
+    def _set(self, cache_name: str, encoded_key: str, value: object, timeout=None) -> None:
+        self._remove(cache_name, encoded_key)
+
+        size = get_approximate_size(value)
+        self.idempotency_key_cache_data[cache_name][encoded_key] = value
+        self.idempotency_key_cache_sizes[cache_name][encoded_key] = size
+        self.idempotency_key_cache_total_sizes[cache_name] += size
+
+        if timeout is None:
+            timeout = self.get_cache_options(cache_name).get('TIMEOUT')
+        if timeout is not None:
+            expiry_time = time.monotonic() + timeout
+            self.idempotency_key_cache_expiry_times[cache_name][encoded_key] = expiry_time
+            heapq.heappush(self.idempotency_key_cache_expiry_heaps[cache_name], (expiry_time, encoded_key))
+
+        self._evict(cache_name)
+        self._compact(cache_name)
+
+    def _remove(self, cache_name: str, encoded_key: str) -> None:
+        the_cache = self.idempotency_key_cache_data[cache_name]
+        if encoded_key in the_cache:
+            del the_cache[encoded_key]
+            self.idempotency_key_cache_total_sizes[cache_name] -= self.idempotency_key_cache_sizes[cache_name].pop(
+                encoded_key
+            )
+            self.idempotency_key_cache_expiry_times[cache_name].pop(encoded_key, None)
+
+    def _expire(self, cache_name: str) -> None:
+        heap = self.idempotency_key_cache_expiry_heaps.get(cache_name)
+        if not heap:
+            return
+
+        now = time.monotonic()
+        expiry_times = self.idempotency_key_cache_expiry_times[cache_name]
+        while heap and heap[0][0] <= now:
+            expiry_time, encoded_key = heapq.heappop(heap)
+            # Entries that have been replaced or removed since being pushed are skipped
+            if expiry_times.get(encoded_key) == expiry_time:
+                self._remove(cache_name, encoded_key)
+
+    def _compact(self, cache_name: str) -> None:
+        # Replaced and evicted entries stay on the expiry heap until their expiry time, so rebuild the heap from the
+        # remaining entries once it is mostly stale to keep its size bounded by the number of entries.
+        heap = self.idempotency_key_cache_expiry_heaps.get(cache_name)
+        expiry_times = self.idempotency_key_cache_expiry_times[cache_name]
+        if heap and len(heap) > 2 * len(expiry_times) + 16:
+            heap[:] = [(expiry_time, encoded_key) for encoded_key, expiry_time in expiry_times.items()]
+            heapq.heapify(heap)
+
+    def _is_full(self, cache_name: str) -> bool:
+        options = self.get_cache_options(cache_name)
+        max_entries = options.get('MAX_ENTRIES')
+        max_bytes = options.get('MAX_BYTES')
+        if max_entries is not None and len(self.idempotency_key_cache_data[cache_name]) > max_entries:
+            return True
+        return max_bytes is not None and self.idempotency_key_cache_total_sizes[cache_name] > max_bytes
+
+    def _evict(self, cache_name: str) -> None:
+        the_cache = self.idempotency_key_cache_data[cache_name]
+        skipped = 0
+        while skipped < len(the_cache) and self._is_full(cache_name):
+            # The least recently used entry is always at the start
+            encoded_key = next(iter(the_cache))
+            if the_cache[encoded_key] is IN_FLIGHT:
+                # Evicting a reservation would let a duplicate run the view function while the original request is
+                # still running, so reservations are skipped and only removed when they expire or are released
+                the_cache.move_to_end(encoded_key)
+                skipped += 1
+            else:
+                self._remove(cache_name, encoded_key)
 
     def store_data(self, cache_name: str, encoded_key: str, response: object) -> None:
-        self.idempotency_key_cache_data[cache_name][encoded_key] = response
+        with self.cache_lock:
+            self._expire(cache_name)
+            self._set(cache_name, encoded_key, response)
 
     def retrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
-        the_cache = self.idempotency_key_cache_data.get(cache_name)
-        if the_cache and encoded_key in the_cache.keys():
-            return True, the_cache[encoded_key]
+        with self.cache_lock:
+            self._expire(cache_name)
+            the_cache = self.idempotency_key_cache_data.get(cache_name)
+            if the_cache and encoded_key in the_cache.keys():
+                the_cache.move_to_end(encoded_key)
+                return True, the_cache[encoded_key]
 
         return False, None
 
+    def reserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        with self.cache_lock:
+            self._expire(cache_name)
+            if encoded_key in self.idempotency_key_cache_data[cache_name]:
+                return False
+
+            self._set(cache_name, encoded_key, IN_FLIGHT, timeout=utils.get_storage_in_flight_ttl())
+            return True
+
+    def release_key(self, cache_name: str, encoded_key: str) -> None:
+        with self.cache_lock:
+            if self.idempotency_key_cache_data[cache_name].get(encoded_key) is IN_FLIGHT:
+                self._remove(cache_name, encoded_key)
+
+    # The data is only ever held in memory for a short time under a lock, so the async methods do not need a thread.
+
+    async def astore_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        self.store_data(cache_name, encoded_key, response)
+
+    async def aretrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        return self.retrieve_data(cache_name, encoded_key)
+
+    async def areserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        return self.reserve_key(cache_name, encoded_key)
+
+    async def arelease_key(self, cache_name: str, encoded_key: str) -> None:
+        self.release_key(cache_name, encoded_key)
+
+    async def aretrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        return self.retrieve_or_reserve(cache_name, encoded_key)
+
     @staticmethod
     def validate_storage(name: str):
         pass
@@ -63,19 +313,419 @@ class MemoryKeyStorage(IdempotencyKeyStorage):
 
 class CacheKeyStorage(IdempotencyKeyStorage):
 
+    def __init__(self):
+        self.serializer = utils.get_storage_serializer_class()()
+
     def store_data(self, cache_name: str, encoded_key: str, response: object) -> None:
-        str_response = pickle.dumps(response)
+        str_response = self.serializer.serialize(response)
         caches[cache_name].set(encoded_key, str_response)
 
     def retrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
-        if encoded_key in caches[cache_name]:
-            str_response = caches[cache_name].get(encoded_key)
-            return True, pickle.loads(str_response)
+        str_response = caches[cache_name].get(encoded_key, _MISSING)
+        if str_response is _MISSING:
+            return False, None
 
-        return False, None
+        if str_response == IN_FLIGHT:
+            return True, IN_FLIGHT
+
+        return True, self.serializer.deserialize(str_response)
+
+    def reserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        return caches[cache_name].add(encoded_key, IN_FLIGHT, timeout=utils.get_storage_in_flight_ttl())
+
+    def release_key(self, cache_name: str, encoded_key: str) -> None:
+        if caches[cache_name].get(encoded_key) == IN_FLIGHT:
+            caches[cache_name].delete(encoded_key)
 
     @staticmethod
     def validate_storage(name: str):
         # Check that the cache exists. If the cache is not found then an InvalidCacheBackendError is raised.
         # Not that there is no get function on the caches object so we cannot perform a normal check.
         caches[name]
+
+
+class TwoTierKeyStorage(CacheKeyStorage):
+    """
+    Uses the django cache like CacheKeyStorage but also keeps a small, short lived copy of recently stored and retrieved
+    responses in the memory of the current process, so repeated requests handled by the same process do not have to go
+    to the cache. The in-process copy is configured with the LOCAL_OPTIONS storage setting.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Responses are kept serialized so that each replay gets its own response object.
+        self.local_storage = MemoryKeyStorage(options=utils.get_storage_local_options())
+
+    def store_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        str_response = self.serializer.serialize(response)
+        caches[cache_name].set(encoded_key, str_response)
+        self.local_storage.store_data(cache_name, encoded_key, str_response)
+
+    def retrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        key_exists, str_response = self.local_storage.retrieve_data(cache_name, encoded_key)
+        if not key_exists:
+            str_response = caches[cache_name].get(encoded_key, _MISSING)
+            if str_response is _MISSING:
+                return False, None
+
+            # Reservations are only ever kept in the django cache so that they are visible to every process
+            if str_response == IN_FLIGHT:
+                return True, IN_FLIGHT
+
+            self.local_storage.store_data(cache_name, encoded_key, str_response)
+
+        return True, self.serializer.deserialize(str_response)
+
+
+class RedisKeyStorage(IdempotencyKeyStorage):
+    """
+    Stores the responses directly in Redis without going through the django cache. The Redis server is specified by the
+    LOCATION storage setting and the cache name is used as part of each key so that different cache names do not clash.
+    Responses expire after the TIMEOUT of the django cache with the same name if there is one.
+    """
+
+    # The reservation is atomic so the middleware does not need to hold a lock around it
+    atomic_reservation = True
+
+    LOOKUP_RESERVED = 0
+    LOOKUP_HIT = 1
+    LOOKUP_IN_FLIGHT = 2
+
+    # Return the stored response, or whether the key is in flight, or reserve the key for the caller in one round trip
+    lookup_script = """
+        local value = redis.call('GET', KEYS[1])
+        if value then
+            if value == ARGV[1] then
+                return {2}
+            end
+            return {1, value}
+        end
+        if ARGV[2] == '' then
+            redis.call('SET', KEYS[1], ARGV[1])
+        else
+            redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        end
+        return {0}
+    """
+
+    # Only delete the key if it is still reserved
+    release_script = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self):
+        location = utils.get_storage_location()
+        if location is None or location == '':
+            raise ValueError('Redis server location must be set in the settings file.')
+
+        self.location = location
+        self.max_connections = utils.get_storage_max_connections()
+        self.django_redis_cache = utils.get_storage_django_redis_cache()
+        self.redis_obj = connections.get_redis_connection(location, self.max_connections, self.django_redis_cache)
+        self.key_prefix = utils.get_storage_key_prefix()
+        self.serializer = utils.get_storage_serializer_class()()
+        self.lookup = self.redis_obj.register_script(self.lookup_script)
+        self.release_if_reserved = self.redis_obj.register_script(self.release_script)
+
+        # The (lookup, release_if_reserved) scripts registered with each async client
+        self.async_scripts = weakref.WeakKeyDictionary()
+
+    def make_key(self, cache_name: str, encoded_key: str) -> str:
+        # Encoded keys are bytes when the ENCODER_OUTPUT setting is 'raw'
+        if isinstance(encoded_key, bytes):
+            return '{}{}:'.format(self.key_prefix, cache_name).encode('UTF-8') + encoded_key
+
+        return '{}{}:{}'.format(self.key_prefix, cache_name, encoded_key)
+
+    @staticmethod
+    def _to_milliseconds(timeout):
+        return None if timeout is None else int(timeout * 1000)
+
+    def _load(self, str_response) -> Tuple[bool, object]:
+        if str_response is None:
+            return False, None
+
+        if str_response == IN_FLIGHT:
+            return True, IN_FLIGHT
+
+        return True, self.serializer.deserialize(str_response)
+
+    def store_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        self.redis_obj.set(
+            self.make_key(cache_name, encoded_key),
+            self.serializer.serialize(response),
+            px=self._to_milliseconds(utils.get_storage_timeout(cache_name)),
+        )
+
+    def retrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        return self._load(self.redis_obj.get(self.make_key(cache_name, encoded_key)))
+
+    def reserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        return bool(self.redis_obj.set(
+            self.make_key(cache_name, encoded_key),
+            IN_FLIGHT,
+            nx=True,
+            px=self._to_milliseconds(utils.get_storage_in_flight_ttl()),
+        ))
+
+    def release_key(self, cache_name: str, encoded_key: str) -> None:
+        self.release_if_reserved(keys=[self.make_key(cache_name, encoded_key)], args=[IN_FLIGHT])
+
+    def retrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        ttl = self._to_milliseconds(utils.get_storage_in_flight_ttl())
+        return self._load_lookup(
+            self.lookup(keys=[self.make_key(cache_name, encoded_key)], args=[IN_FLIGHT, ttl or ''])
+        )
+
+    def _load_lookup(self, result) -> Tuple[bool, object]:
+        if result[0] == self.LOOKUP_RESERVED:
+            return False, None
+
+        if result[0] == self.LOOKUP_IN_FLIGHT:
+            return True, IN_FLIGHT
+
+        return True, self.serializer.deserialize(result[1])
+
+    def _get_async_redis_connection(self):
+        """
+        Get the async Redis client for the running event loop along with its scripts, or (None, None, None) if the
+        django-redis client is used, in which case the sync client is used in a thread instead.
+        """
+        if self.django_redis_cache:
+            return None, None, None
+
+        redis_obj = connections.get_async_redis_connection(self.location, self.max_connections)
+        scripts = self.async_scripts.get(redis_obj)
+        if scripts is None:
+            scripts = self.async_scripts[redis_obj] = (
+                redis_obj.register_script(self.lookup_script),
+                redis_obj.register_script(self.release_script),
+            )
+        return (redis_obj,) + scripts
+
+    async def astore_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        redis_obj, _, _ = self._get_async_redis_connection()
+        if redis_obj is None:
+            return await super().astore_data(cache_name, encoded_key, response)
+
+        await redis_obj.set(
+            self.make_key(cache_name, encoded_key),
+            self.serializer.serialize(response),
+            px=self._to_milliseconds(utils.get_storage_timeout(cache_name)),
+        )
+
+    async def aretrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        redis_obj, _, _ = self._get_async_redis_connection()
+        if redis_obj is None:
+            return await super().aretrieve_data(cache_name, encoded_key)
+
+        return self._load(await redis_obj.get(self.make_key(cache_name, encoded_key)))
+
+    async def areserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        redis_obj, _, _ = self._get_async_redis_connection()
+        if redis_obj is None:
+            return await super().areserve_key(cache_name, encoded_key)
+
+        return bool(await redis_obj.set(
+            self.make_key(cache_name, encoded_key),
+            IN_FLIGHT,
+            nx=True,
+            px=self._to_milliseconds(utils.get_storage_in_flight_ttl()),
+        ))
+
+    async def arelease_key(self, cache_name: str, encoded_key: str) -> None:
+        redis_obj, _, release_if_reserved = self._get_async_redis_connection()
+        if redis_obj is None:
+            return await super().arelease_key(cache_name, encoded_key)
+
+        await release_if_reserved(keys=[self.make_key(cache_name, encoded_key)], args=[IN_FLIGHT])
+
+    async def aretrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        redis_obj, lookup, _ = self._get_async_redis_connection()
+        if redis_obj is None:
+            return await super().aretrieve_or_reserve(cache_name, encoded_key)
+
+        ttl = self._to_milliseconds(utils.get_storage_in_flight_ttl())
+        return self._load_lookup(
+            await lookup(keys=[self.make_key(cache_name, encoded_key)], args=[IN_FLIGHT, ttl or ''])
+        )
+
+    @staticmethod
+    def validate_storage(name: str):
+        pass
+
+
+def copy_response(response: object) -> object:
+    """
+    Shallow copy a response along with its headers and cookies, so that changes made to the original response by the
+    middleware that processes it after this one are not seen by the copy.
+    """
+    response = copy.copy(response)
+    headers = getattr(response, 'headers', None)
+    if ResponseHeaders is not None and isinstance(headers, ResponseHeaders):
+        response.headers = ResponseHeaders(headers)
+    elif isinstance(getattr(response, '_headers', None), dict):  # django < 3.2
+        response._headers = dict(response._headers)
+    if isinstance(getattr(response, 'cookies', None), SimpleCookie):
+        response.cookies = copy.copy(response.cookies)
+    return response
+
+
+# Every WriteBehindKeyStorage object in the process, so that their queues can be flushed when the process exits
+_write_behind_storages = weakref.WeakSet()
+
+
+class WriteBehindKeyStorage(IdempotencyKeyStorage):
+    """
+    Wraps another storage object so that store_data returns straight away and the response is serialized and written
+    to the storage by a background thread. Used by the middleware when the WRITE_BEHIND storage setting is True.
+
+    Responses are kept in memory until they are written and lookups made in this process return them, so duplicates
+    that arrive before the write are still answered with the stored response. Other processes see the in-flight
+    reservation, if there is one, until then. A key stored again while it is still queued replaces the queued response
+    so it is only written once. When `queue_size` keys are queued store_data writes to the storage itself instead, which
+    slows down the requests rather than letting the queue grow. The queue is flushed when the process exits.
+    """
+
+    def __init__(self, storage: IdempotencyKeyStorage, queue_size: int = 1000, flush_timeout: float = 10):
+        self.storage = storage
+        self.atomic_reservation = storage.atomic_reservation
+        self.queue_size = queue_size
+        self.flush_timeout = flush_timeout
+
+        # The responses waiting to be written keyed by (cache_name, encoded_key), oldest first
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.worker = None
+        _write_behind_storages.add(self)
+
+    def _start_worker(self):
+        # Also restarts the worker in a process forked after it was started
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run, name='idempotency-key-write-behind', daemon=True)
+            self.worker.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                # The response stays in pending while it is written so lookups in this process still find it
+                key, response = next(iter(self.pending.items()))
+
+            self._write(key, response)
+
+            with self.condition:
+                # Keep the key queued if it was stored again while being written
+                if self.pending.get(key) is response:
+                    del self.pending[key]
+                self.condition.notify_all()
+
+    def _write(self, key, response):
+        try:
+            self.storage.store_data(key[0], key[1], response)
+            return
+        except Exception:
+            logger.exception('Failed to write the response for the idempotency key: %s', key[1])
+
+        # Release the in-flight reservation so that retries of the request run the view function instead of being
+        # locked out until the reservation expires
+        try:
+            self.storage.release_key(key[0], key[1])
+        except Exception:
+            logger.exception('Failed to release the idempotency key: %s', key[1])
+
+    def _get_pending(self, cache_name: str, encoded_key: str):
+        with self.condition:
+            return self.pending.get((cache_name, encoded_key), _MISSING)
+
+    def _queue(self, cache_name: str, encoded_key: str, response: object) -> bool:
+        key = (cache_name, encoded_key)
+        with self.condition:
+            if key not in self.pending and len(self.pending) >= self.queue_size:
+                return False
+
+            # The response is serialized by the worker while it may still be changed by other middleware
+            self.pending[key] = copy_response(response)
+            self._start_worker()
+            self.condition.notify_all()
+            return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every queued response has been written.
+        :param timeout: The maximum number of seconds to wait, or None to wait until they are written
+        :return: False if the timeout ran out first
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending, timeout)
+
+    def store_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        if not self._queue(cache_name, encoded_key, response):
+            self.storage.store_data(cache_name, encoded_key, response)
+
+    def retrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        response = self._get_pending(cache_name, encoded_key)
+        if response is not _MISSING:
+            # The middleware changes the status code of the response it replays
+            return True, copy_response(response)
+        return self.storage.retrieve_data(cache_name, encoded_key)
+
+    def reserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        if self._get_pending(cache_name, encoded_key) is not _MISSING:
+            return False
+        return self.storage.reserve_key(cache_name, encoded_key)
+
+    def release_key(self, cache_name: str, encoded_key: str) -> None:
+        self.storage.release_key(cache_name, encoded_key)
+
+    def retrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        response = self._get_pending(cache_name, encoded_key)
+        if response is not _MISSING:
+            # The middleware changes the status code of the response it replays
+            return True, copy_response(response)
+        return self.storage.retrieve_or_reserve(cache_name, encoded_key)
+
+    # Queued responses are checked without blocking, so only the wrapped storage's async methods are awaited.
+
+    async def astore_data(self, cache_name: str, encoded_key: str, response: object) -> None:
+        if not self._queue(cache_name, encoded_key, response):
+            await self.storage.astore_data(cache_name, encoded_key, response)
+
+    async def aretrieve_data(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        response = self._get_pending(cache_name, encoded_key)
+        if response is not _MISSING:
+            # The middleware changes the status code of the response it replays
+            return True, copy_response(response)
+        return await self.storage.aretrieve_data(cache_name, encoded_key)
+
+    async def areserve_key(self, cache_name: str, encoded_key: str) -> bool:
+        if self._get_pending(cache_name, encoded_key) is not _MISSING:
+            return False
+        return await self.storage.areserve_key(cache_name, encoded_key)
+
+    async def arelease_key(self, cache_name: str, encoded_key: str) -> None:
+        await self.storage.arelease_key(cache_name, encoded_key)
+
+    async def aretrieve_or_reserve(self, cache_name: str, encoded_key: str) -> Tuple[bool, object]:
+        response = self._get_pending(cache_name, encoded_key)
+        if response is not _MISSING:
+            # The middleware changes the status code of the response it replays
+            return True, copy_response(response)
+        return await self.storage.aretrieve_or_reserve(cache_name, encoded_key)
+
+    @staticmethod
+    def validate_storage(name: str):
+        # The cache names are validated by the class of the wrapped storage object
+        pass
+
+
+@atexit.register
+def flush_write_behind_storages():
+    for storage in list(_write_behind_storages):
+        if not storage.flush(storage.flush_timeout):
+            logger.error(
+                'Idempotency key responses were not written before the process exited: %s', len(storage.pending)
+            )
@@ -1,8 +1,27 @@
+from collections import namedtuple
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
 from django.utils import module_loading
 
 from idempotency_key import status
 
+# Immutable snapshot of the settings used on every request. See get_settings().
+IdempotencyKeySettings = namedtuple('IdempotencyKeySettings', [
+    'conflict_code',
+    'storage_cache_name',
+    'storage_store_on_statuses',
+    'storage_in_flight_reservation',
+    'storage_coalesce',
+    'storage_coalesce_timeout',
+    'storage_deadline',
+    'lock_enable',
+])
+
+_settings = None
+
 
 def idempotency_key_exists(request):
     return getattr(request, 'idempotency_key_exists', False)
@@ -22,6 +41,22 @@ def get_encoder_class():
     )
 
 
+def get_encoder_algorithm():
+    return get_idempotency_key_settings().get('ENCODER_ALGORITHM', 'sha256')
+
+
+def get_encoder_digest_size():
+    return get_idempotency_key_settings().get('ENCODER_DIGEST_SIZE', None)
+
+
+def get_encoder_output():
+    return get_idempotency_key_settings().get('ENCODER_OUTPUT', 'hex')
+
+
+def get_encoder_chunk_size():
+    return get_idempotency_key_settings().get('ENCODER_CHUNK_SIZE', 64 * 1024)
+
+
 def get_conflict_code():
     return get_idempotency_key_settings().get('CONFLICT_STATUS_CODE', status.HTTP_409_CONFLICT)
 
@@ -36,10 +71,62 @@ def get_storage_class():
     )
 
 
+def get_storage_serializer_class():
+    return module_loading.import_string(get_storage_settings().get(
+        'SERIALIZER_CLASS', 'idempotency_key.serializers.PickleSerializer')
+    )
+
+
 def get_storage_cache_name():
     return get_storage_settings().get('CACHE_NAME', 'default')
 
 
+def get_storage_location():
+    return get_storage_settings().get('LOCATION', 'redis://localhost:6379/1')
+
+
+def get_storage_max_connections():
+    return get_storage_settings().get('MAX_CONNECTIONS', None)
+
+
+def get_storage_django_redis_cache():
+    return get_storage_settings().get('DJANGO_REDIS_CACHE', None)
+
+
+def get_storage_key_prefix():
+    return get_storage_settings().get('KEY_PREFIX', 'idempotency_key:')
+
+
+def get_storage_memory_options(cache_name):
+    return get_storage_settings().get('MEMORY_OPTIONS', dict()).get(cache_name, dict())
+
+
+def get_storage_local_options():
+    return get_storage_settings().get('LOCAL_OPTIONS', {
+        'MAX_ENTRIES': 1000,
+        'TIMEOUT': 5,
+    })
+
+
+def get_storage_cache_timeout(cache_name):
+    # Use the same timeout as the django cache with the same name, if there is one, otherwise never expire.
+    cache_settings = getattr(settings, 'CACHES', dict()).get(cache_name)
+    if cache_settings is None:
+        return None
+    return cache_settings.get('TIMEOUT', 300)  # django's default cache timeout
+
+
+def get_storage_timeout(cache_name):
+    # The TIMEOUT storage setting if given, which may be None to never expire, otherwise the same timeout as the django
+    # cache with the same name if there is one, otherwise 5 minutes.
+    storage_settings = get_storage_settings()
+    if 'TIMEOUT' in storage_settings:
+        return storage_settings['TIMEOUT']
+    if cache_name in getattr(settings, 'CACHES', dict()):
+        return get_storage_cache_timeout(cache_name)
+    return 300
+
+
 def get_storage_store_on_statuses():
     return get_storage_settings().get(
         'STORE_ON_STATUSES', [
@@ -55,6 +142,52 @@ def get_storage_store_on_statuses():
     )
 
 
+def get_storage_in_flight_reservation():
+    return get_storage_settings().get('IN_FLIGHT_RESERVATION', False)
+
+
+def get_storage_in_flight_ttl():
+    return get_storage_settings().get('IN_FLIGHT_TTL', 300)  # default to 5 minutes
+
+
+def get_storage_coalesce():
+    return get_storage_settings().get('COALESCE', False)
+
+
+def get_storage_coalesce_timeout():
+    return get_storage_settings().get('COALESCE_TIMEOUT', 5.0)
+
+
+def get_storage_write_behind():
+    return get_storage_settings().get('WRITE_BEHIND', False)
+
+
+def get_storage_write_behind_queue_size():
+    return get_storage_settings().get('WRITE_BEHIND_QUEUE_SIZE', 1000)
+
+
+def get_storage_write_behind_flush_timeout():
+    return get_storage_settings().get('WRITE_BEHIND_FLUSH_TIMEOUT', 10)
+
+
+def get_storage_store_on_commit():
+    return get_storage_settings().get('STORE_ON_COMMIT', False)
+
+
+def get_storage_store_on_commit_database():
+    return get_storage_settings().get('STORE_ON_COMMIT_DATABASE', DEFAULT_DB_ALIAS)
+
+
+def get_storage_deadline_ms():
+    return get_storage_settings().get('DEADLINE_MS', None)
+
+
+def get_storage_deadline():
+    # The DEADLINE_MS setting in seconds
+    deadline_ms = get_storage_deadline_ms()
+    return None if deadline_ms is None else deadline_ms / 1000
+
+
 def get_lock_settings():
     return get_idempotency_key_settings().get('LOCK', dict())
 
@@ -81,3 +214,83 @@ def get_lock_time_to_live():
 
 def get_lock_name():
     return get_lock_settings().get('NAME', 'MyLock')
+
+
+def get_lock_stripes():
+    return get_lock_settings().get('STRIPES', 64)
+
+
+def get_lock_per_key():
+    return get_lock_settings().get('PER_KEY', False)
+
+
+def get_lock_key_prefix():
+    return get_lock_settings().get('KEY_PREFIX', 'idempotency_key_lock:')
+
+
+def get_lock_max_connections():
+    return get_lock_settings().get('MAX_CONNECTIONS', None)
+
+
+def get_lock_django_redis_cache():
+    return get_lock_settings().get('DJANGO_REDIS_CACHE', None)
+
+
+def get_circuit_breaker_settings():
+    return get_idempotency_key_settings().get('CIRCUIT_BREAKER', dict())
+
+
+def get_circuit_breaker_enable():
+    return get_circuit_breaker_settings().get('ENABLE', False)
+
+
+def get_circuit_breaker_mode():
+    return get_circuit_breaker_settings().get('MODE', 'fail-open')
+
+
+def get_circuit_breaker_window():
+    return get_circuit_breaker_settings().get('WINDOW', 30)
+
+
+def get_circuit_breaker_min_calls():
+    return get_circuit_breaker_settings().get('MIN_CALLS', 20)
+
+
+def get_circuit_breaker_failure_rate():
+    return get_circuit_breaker_settings().get('FAILURE_RATE', 0.5)
+
+
+def get_circuit_breaker_slow_call_duration():
+    return get_circuit_breaker_settings().get('SLOW_CALL_DURATION', 1.0)
+
+
+def get_circuit_breaker_reset_timeout():
+    return get_circuit_breaker_settings().get('RESET_TIMEOUT', 30)
+
+
+def get_settings():
+    """
+    Get the settings used on every request. These are only read from the django settings the first time this is called
+    and again after the IDEMPOTENCY_KEY setting is changed.
+    """
+    global _settings
+    idempotency_key_settings = _settings
+    if idempotency_key_settings is None:
+        idempotency_key_settings = _settings = IdempotencyKeySettings(
+            conflict_code=get_conflict_code(),
+            storage_cache_name=get_storage_cache_name(),
+            storage_store_on_statuses=frozenset(get_storage_store_on_statuses()),
+            storage_in_flight_reservation=get_storage_in_flight_reservation(),
+            storage_coalesce=get_storage_coalesce(),
+            storage_coalesce_timeout=get_storage_coalesce_timeout(),
+            storage_deadline=get_storage_deadline(),
+            lock_enable=get_lock_enable(),
+        )
+    return idempotency_key_settings
+
+
+@receiver(setting_changed)
+def reset_settings(setting, **kwargs):
+    global _settings
+    if setting == 'IDEMPOTENCY_KEY':
+        _settings = None
@@ -36,6 +36,10 @@ setup(
     install_requires=[
         'Django>=1.11'
     ],
+    extras_require={
+        'redis': ['redis>=3.0'],
+        'xxhash': ['xxhash>=2.0'],
+    },
     project_urls={
         'Documentation': 'https://github.com/yoyowallet/django-idempotency-key/blob/master/README.md',
         'Source': 'https://github.com/yoyowallet/django-idempotency-key',
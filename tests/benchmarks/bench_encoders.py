@@ -0,0 +1,52 @@
+"""
+Benchmarks the cost of encoding the idempotency key of a request for each hash algorithm and body size.
+These are not collected with the tests and are run with:
+
+    make benchmark
+
+pytest-benchmark must be installed.
+"""
+from django.test import override_settings
+import pytest
+
+from idempotency_key.encoders import BasicKeyEncoder, StreamingKeyEncoder
+
+pytest.importorskip('pytest_benchmark')
+
+BODY_SIZES = {
+    '1KB': 1024,
+    '64KB': 64 * 1024,
+    '1MB': 1024 * 1024,
+    '10MB': 10 * 1024 * 1024,
+}
+
+ENCODER_SETTINGS = {
+    'sha256-hex': {},
+    'sha1-hex': {'ENCODER_ALGORITHM': 'sha1'},
+    'blake2b-16-base64url': {'ENCODER_ALGORITHM': 'blake2b', 'ENCODER_DIGEST_SIZE': 16, 'ENCODER_OUTPUT': 'base64url'},
+    'xxh3_64-raw': {'ENCODER_ALGORITHM': 'xxh3_64', 'ENCODER_OUTPUT': 'raw'},
+    'xxh3_128-hex': {'ENCODER_ALGORITHM': 'xxh3_128'},
+}
+
+
+# request.body refuses to read bodies larger than DATA_UPLOAD_MAX_MEMORY_SIZE
+@override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=None)
+@pytest.mark.parametrize('encoder_class', [BasicKeyEncoder, StreamingKeyEncoder], ids=lambda cls: cls.__name__)
+@pytest.mark.parametrize('settings_name', ENCODER_SETTINGS)
+@pytest.mark.parametrize('body_size', BODY_SIZES)
+def test_encode_key(benchmark, rf, encoder_class, settings_name, body_size):
+    encoder_settings = ENCODER_SETTINGS[settings_name]
+    if encoder_settings.get('ENCODER_ALGORITHM', '').startswith('xxh'):
+        pytest.importorskip('xxhash')
+
+    benchmark.group = 'encode_key {}'.format(body_size)
+    body = b'x' * BODY_SIZES[body_size]
+
+    with override_settings(IDEMPOTENCY_KEY=encoder_settings):
+        encoder = encoder_class()
+
+    # A new request is needed for every round because the body can only be read once
+    def setup():
+        return (rf.post('/views/create/', body, 'application/octet-stream'), 'MyKey'), {}
+
+    benchmark.pedantic(encoder.encode_key, setup=setup, rounds=20)
@@ -0,0 +1,132 @@
+"""
+Benchmarks the overhead the middleware adds to each request for each storage class, lock class and body size.
+The view functions do nothing so only the time spent in the middleware is measured.
+These are not collected with the tests and are run with:
+
+    make benchmark
+
+pytest-benchmark must be installed.
+"""
+import tempfile
+import uuid
+
+from django.http import HttpResponse
+from django.test import override_settings
+import pytest
+
+from idempotency_key.decorators import idempotency_key, idempotency_key_exempt
+from idempotency_key.middleware import ExemptIdempotencyKeyMiddleware, IdempotencyKeyMiddleware
+
+pytest.importorskip('pytest_benchmark')
+
+cache_dir = tempfile.TemporaryDirectory()
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': cache_dir.name,
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+STORAGES = {
+    'memory': {'CLASS': 'idempotency_key.storage.MemoryKeyStorage'},
+    'cache-locmem': {'CLASS': 'idempotency_key.storage.CacheKeyStorage', 'CACHE_NAME': 'locmem'},
+    'cache-file': {'CLASS': 'idempotency_key.storage.CacheKeyStorage', 'CACHE_NAME': 'file'},
+}
+
+LOCKS = {
+    'thread': {'CLASS': 'idempotency_key.locks.ThreadLock'},
+    'striped': {'CLASS': 'idempotency_key.locks.StripedThreadLock'},
+    'redis': {'CLASS': 'idempotency_key.locks.MultiProcessRedisLock'},
+    'redis-per-key': {'CLASS': 'idempotency_key.locks.MultiProcessRedisLock', 'PER_KEY': True},
+    'disabled': {'ENABLE': False},
+}
+
+BODY_SIZES = {
+    '0B': 0,
+    '1KB': 1024,
+    '1MB': 1024 * 1024,
+}
+
+
+def view(request, *args, **kwargs):
+    return HttpResponse(status=201)
+
+
+@idempotency_key_exempt
+def exempt_view(request, *args, **kwargs):
+    return HttpResponse(status=201)
+
+
+@idempotency_key
+def opt_in_view(request, *args, **kwargs):
+    return HttpResponse(status=201)
+
+
+# (middleware class, view function, method, whether each request uses a new idempotency key)
+SCENARIOS = {
+    'first-seen': (IdempotencyKeyMiddleware, view, 'post', True),
+    'replay': (IdempotencyKeyMiddleware, view, 'post', False),
+    'exempt-decorator': (IdempotencyKeyMiddleware, exempt_view, 'post', False),
+    'exempt-middleware': (ExemptIdempotencyKeyMiddleware, view, 'post', False),
+    'opt-in-replay': (ExemptIdempotencyKeyMiddleware, opt_in_view, 'post', False),
+    'safe-method': (IdempotencyKeyMiddleware, view, 'get', False),
+}
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_obj = fakeredis.FakeRedis()
+    mocker.patch('idempotency_key.connections.get_redis_connection', return_value=redis_obj)
+    yield redis_obj
+    redis_obj.flushall()
+
+
+def run_benchmark(benchmark, rf, scenario, storage, lock, body_size):
+    middleware_class, view_func, method, new_keys = SCENARIOS[scenario]
+    body = b'x' * BODY_SIZES[body_size]
+    idempotency_key_settings = {'STORAGE': STORAGES[storage], 'LOCK': LOCKS[lock]}
+
+    with override_settings(CACHES=CACHES, IDEMPOTENCY_KEY=idempotency_key_settings):
+        # Mimic the django request handler, which calls process_view after the middleware has called get_response
+        def get_response(request):
+            return middleware.process_view(request, view_func, (), {}) or view_func(request)
+
+        middleware = middleware_class(get_response)
+
+        def setup():
+            key = str(uuid.uuid4()) if new_keys else 'replayed-key'
+            if method == 'get':
+                request = rf.get('/views/', HTTP_IDEMPOTENCY_KEY=key)
+            else:
+                request = rf.post('/views/', body, 'application/octet-stream', HTTP_IDEMPOTENCY_KEY=key)
+            return (request,), {}
+
+        # Store the response for the replayed key before measuring
+        middleware(*setup()[0])
+
+        benchmark.group = '{} {}'.format(scenario, body_size)
+        benchmark.pedantic(middleware, setup=setup, rounds=200, warmup_rounds=10)
+
+
+@pytest.mark.parametrize('body_size', BODY_SIZES)
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_middleware_storage(benchmark, rf, scenario, storage, body_size):
+    run_benchmark(benchmark, rf, scenario, storage, 'thread', body_size)
+
+
+@pytest.mark.parametrize('lock', LOCKS)
+@pytest.mark.parametrize('scenario', ['first-seen', 'replay'])
+def test_middleware_lock(benchmark, rf, fake_redis, scenario, lock):
+    run_benchmark(benchmark, rf, scenario, 'memory', lock, '1KB')
@@ -0,0 +1,131 @@
+"""
+Fires the same idempotency key from many threads at the same time and counts how many times the view actually runs.
+Each thread sends one request for every key and all of the threads wait for each other before sending each request.
+The requests go through the test project's middleware and urls.py using a single request handler shared by every
+thread, as they would in a threaded WSGI server.
+
+For each lock class, with and without IN_FLIGHT_RESERVATION, the following are reported:
+- the number of extra times the view ran per key (0 means no duplicate executions)
+- the rates of HTTP_409_CONFLICT and HTTP_423_LOCKED responses
+- the p50 and p99 latency and the throughput
+
+MultiProcessRedisLock uses fakeredis instead of a Redis server. Run from the root of the repository with:
+
+    python -m tests.benchmarks.duplicate_storm --threads 16 --keys 50 --view-delay 0.01
+"""
+import argparse
+from collections import Counter
+import logging
+import os
+import threading
+import time
+from unittest import mock
+import uuid
+
+CONFIGURATIONS = [
+    ('ThreadLock', {'CLASS': 'idempotency_key.locks.ThreadLock'}),
+    ('MultiProcessRedisLock', {'CLASS': 'idempotency_key.locks.MultiProcessRedisLock'}),
+    ('MultiProcessRedisLock per key', {'CLASS': 'idempotency_key.locks.MultiProcessRedisLock', 'PER_KEY': True}),
+    ('Locking disabled', {'ENABLE': False}),
+]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def run_storm(lock_settings, in_flight_reservation, threads, keys):
+    from django.conf import settings
+    from django.core.handlers.base import BaseHandler
+    from django.test import RequestFactory, override_settings
+
+    from tests import views
+
+    idempotency_key_settings = {
+        'LOCK': lock_settings,
+        'STORAGE': {'IN_FLIGHT_RESERVATION': in_flight_reservation},
+    }
+    middleware = settings.MIDDLEWARE + ['idempotency_key.middleware.IdempotencyKeyMiddleware']
+
+    with override_settings(
+            ALLOWED_HOSTS=['testserver'], MIDDLEWARE=middleware, IDEMPOTENCY_KEY=idempotency_key_settings
+    ):
+        handler = BaseHandler()
+        handler.load_middleware()
+
+        factory = RequestFactory()
+        idempotency_keys = [str(uuid.uuid4()) for _ in range(keys)]
+        barrier = threading.Barrier(threads)
+        results_lock = threading.Lock()
+        latencies = []
+        status_codes = Counter()
+        views.view_executions.clear()
+
+        def client():
+            for key in idempotency_keys:
+                request = factory.post('/views/create-counted/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=key)
+                barrier.wait()
+                start = time.perf_counter()
+                response = handler.get_response(request)
+                elapsed = time.perf_counter() - start
+                with results_lock:
+                    latencies.append(elapsed)
+                    status_codes[response.status_code] += 1
+
+        clients = [threading.Thread(target=client) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    requests = threads * keys
+    latencies.sort()
+    return {
+        'extra_executions': (sum(views.view_executions.values()) - len(views.view_executions)) / keys,
+        'conflict_rate': status_codes[409] / requests,
+        'locked_rate': status_codes[423] / requests,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'throughput': requests / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16, help='concurrent clients sending each key')
+    parser.add_argument('--keys', type=int, default=50, help='number of idempotency keys to send')
+    parser.add_argument('--view-delay', type=float, default=0.01, help='seconds the view takes to run')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    import django
+    django.setup()
+
+    import fakeredis
+
+    from tests import views
+
+    views.view_delay = args.view_delay
+    # Every 409 and 423 response is logged as a warning otherwise
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    print('{} threads x {} keys, view delay {}s'.format(args.threads, args.keys, args.view_delay))
+    print('{:<32}{:>10}{:>12}{:>8}{:>8}{:>11}{:>11}{:>10}'.format(
+        'Lock', 'In flight', 'Extra runs', '409', '423', 'p50 (ms)', 'p99 (ms)', 'req/s'
+    ))
+    for name, lock_settings in CONFIGURATIONS:
+        for in_flight_reservation in (False, True):
+            # Each run gets an empty fake Redis server shared by all of its threads
+            with mock.patch('idempotency_key.connections.get_redis_connection', return_value=fakeredis.FakeRedis()):
+                result = run_storm(lock_settings, in_flight_reservation, args.threads, args.keys)
+
+            print('{:<32}{:>10}{:>12.2f}{:>8.1%}{:>8.1%}{:>11.2f}{:>11.2f}{:>10.0f}'.format(
+                name, 'yes' if in_flight_reservation else 'no', result['extra_executions'], result['conflict_rate'],
+                result['locked_rate'], result['p50'], result['p99'], result['throughput'],
+            ))
+
+
+if __name__ == '__main__':
+    main()
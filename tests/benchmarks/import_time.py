@@ -0,0 +1,52 @@
+"""
+Measures how long a new process takes to import the middleware and the lock classes, which utils.get_lock_class loads
+when the middleware is created, and lists the optional client libraries that were imported along with them. This is
+paid by every worker when it starts.
+Each import is run in a new python process and the median of the runs is reported. Run from the root of the repository
+with:
+
+    python -m tests.benchmarks.import_time --runs 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+MODULES = ['idempotency_key.middleware', 'idempotency_key.locks']
+
+OPTIONAL_MODULES = ('redis', 'django_redis', 'xxhash')
+
+IMPORT_SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+import {modules}
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(','.join(name for name in {optional_modules!r} if name in sys.modules))
+"""
+
+
+def time_import(modules):
+    script = IMPORT_SCRIPT.format(modules=', '.join(modules), optional_modules=OPTIONAL_MODULES)
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings')
+    output = subprocess.check_output([sys.executable, '-c', script], env=env, universal_newlines=True).splitlines()
+    return float(output[0]), output[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='number of processes to time the import in')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='the modules to import')
+    args = parser.parse_args()
+
+    results = [time_import(args.modules) for _ in range(args.runs)]
+    times = sorted(elapsed for elapsed, _ in results)
+    print('import {}: median {:.1f}ms, min {:.1f}ms over {} runs'.format(
+        ', '.join(args.modules), times[len(times) // 2] * 1000, times[0] * 1000, args.runs
+    ))
+    print('optional modules imported: {}'.format(results[0][1] or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.test import modify_settings, override_settings
+import pytest
+
+from idempotency_key.checks import check_settings, get_cache_names, get_view_functions
+from idempotency_key.middleware import IdempotencyKeyMiddleware
+
+
+def error_ids(errors):
+    return [error.id for error in errors]
+
+
+def test_default_settings_are_valid():
+    assert check_settings(None) == []
+
+
+def test_cache_names_from_urlconf():
+    cache_names = get_cache_names()
+    assert cache_names['default'] == ['STORAGE.CACHE_NAME setting']
+    # Both the view function and the viewset action use the FiveMinuteCache
+    assert 'tests.views.create_with_my_cache' in cache_names['FiveMinuteCache']
+    assert 'tests.viewsets.MyViewSet.create_with_my_cache' in cache_names['FiveMinuteCache']
+
+
+class RegexURLPattern:
+    def __init__(self, callback):
+        self.callback = callback
+
+
+class RegexURLResolver:
+    def __init__(self, url_patterns):
+        self.url_patterns = url_patterns
+
+
+def test_view_functions_from_regex_patterns():
+    # Django < 2.0 uses the RegexURLPattern and RegexURLResolver classes instead of URLPattern and URLResolver
+    patterns = [RegexURLResolver([RegexURLPattern(test_default_settings_are_valid)])]
+    assert list(get_view_functions(patterns)) == [
+        ('tests.tests.test_checks.test_default_settings_are_valid', test_default_settings_are_valid),
+    ]
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'ENCODER_CLASS': 'idempotency_key.encoders.MissingEncoder',
+        'STORAGE': {'CLASS': 'idempotency_key.storage.MissingStorage'},
+        'LOCK': {'CLASS': 'idempotency_key.locks.MissingLock'},
+    }
+)
+def test_class_settings_cannot_be_imported():
+    errors = check_settings(None)
+    assert error_ids(errors) == ['idempotency_key.E001'] * 3
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_ALGORITHM': 'unknown'}
+)
+def test_invalid_encoder_settings():
+    assert error_ids(check_settings(None)) == ['idempotency_key.E002']
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_ALGORITHM': 'blake2b', 'ENCODER_DIGEST_SIZE': 100}
+)
+def test_invalid_encoder_digest_size():
+    assert error_ids(check_settings(None)) == ['idempotency_key.E002']
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'ENCODER_OUTPUT': 'raw',
+        'STORAGE': {'CLASS': 'idempotency_key.storage.CacheKeyStorage'},
+    }
+)
+def test_raw_encoder_output_with_cache_storage():
+    assert error_ids(check_settings(None)) == ['idempotency_key.E007']
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_OUTPUT': 'raw'}
+)
+def test_raw_encoder_output_with_memory_storage():
+    assert check_settings(None) == []
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'STORAGE': {
+            'CLASS': 'idempotency_key.storage.CacheKeyStorage',
+            'CACHE_NAME': 'MissingCache',
+        },
+    },
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    },
+)
+def test_all_invalid_cache_names_reported():
+    errors = check_settings(None)
+    assert error_ids(errors) == ['idempotency_key.E003'] * 2
+    assert '"MissingCache"' in errors[0].msg
+    assert '"FiveMinuteCache"' in errors[1].msg
+    assert 'tests.views.create_with_my_cache' in errors[1].hint
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'CLASS': 'idempotency_key.locks.MultiProcessRedisLock',
+            'LOCATION': '',
+            'TIMEOUT': -1,
+            'TTL': 0,
+            'STRIPES': 0,
+        },
+    },
+)
+def test_invalid_lock_settings():
+    assert error_ids(check_settings(None)) == ['idempotency_key.E004'] * 4
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'CIRCUIT_BREAKER': {
+            'MODE': 'fail-fast',
+            'FAILURE_RATE': 0,
+            'WINDOW': 0,
+            'RESET_TIMEOUT': None,
+        },
+    },
+)
+def test_invalid_circuit_breaker_settings():
+    assert error_ids(check_settings(None)) == ['idempotency_key.E005'] * 4
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'STORAGE': {
+            'DEADLINE_MS': 0,
+            'STORE_ON_COMMIT': True,
+            'STORE_ON_COMMIT_DATABASE': 'missing',
+            'WRITE_BEHIND_QUEUE_SIZE': 0,
+            'TIMEOUT': 0,
+        },
+    }
+)
+def test_invalid_storage_settings():
+    assert error_ids(check_settings(None)) == ['idempotency_key.E006'] * 4
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'CLASS': 'idempotency_key.storage.CacheKeyStorage', 'CACHE_NAME': 'MissingCache'}},
+)
+def test_middleware_checks_settings_when_app_not_installed():
+    # The system check reports the problem when the app is installed
+    IdempotencyKeyMiddleware()
+
+    with modify_settings(INSTALLED_APPS={'remove': 'idempotency_key'}):
+        with pytest.raises(ImproperlyConfigured, match='idempotency_key.E003'):
+            IdempotencyKeyMiddleware()
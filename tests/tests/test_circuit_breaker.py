@@ -0,0 +1,222 @@
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, override_settings
+import pytest
+
+from idempotency_key import status
+from idempotency_key.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from idempotency_key.middleware import IdempotencyKeyMiddleware
+from idempotency_key.storage import IN_FLIGHT, MemoryKeyStorage
+from tests.tests.utils import set_middleware
+
+the_key = '7495e32b-709b-4fae-bfd4-2497094bf3fd'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingStorage(MemoryKeyStorage):
+    """
+    Raises when looking up keys while `retrieve_fails` is True and when storing responses while `store_fails` is True.
+    """
+    retrieve_fails = True
+    store_fails = False
+    retrieve_calls = 0
+
+    def retrieve_data(self, cache_name, encoded_key):
+        FailingStorage.retrieve_calls += 1
+        if self.retrieve_fails:
+            raise ConnectionError('The storage is unavailable')
+        return super().retrieve_data(cache_name, encoded_key)
+
+    def store_data(self, cache_name, encoded_key, response):
+        if self.store_fails:
+            raise ConnectionError('The storage is unavailable')
+        super().store_data(cache_name, encoded_key, response)
+
+
+class FailingPollStorage(FailingStorage):
+    """
+    Reserves keys without calling retrieve_data, so only the storage polls made by coalesced duplicates fail.
+    """
+
+    def retrieve_or_reserve(self, cache_name, encoded_key):
+        if not self.reserve_key(cache_name, encoded_key):
+            return True, IN_FLIGHT
+        return False, None
+
+
+@pytest.fixture
+def failing_storage():
+    FailingStorage.retrieve_fails = True
+    FailingStorage.store_fails = False
+    FailingStorage.retrieve_calls = 0
+    yield FailingStorage
+
+
+def circuit_breaker_settings(**kwargs):
+    return {
+        'STORAGE': {'CLASS': 'tests.tests.test_circuit_breaker.FailingStorage'},
+        'CIRCUIT_BREAKER': dict({'ENABLE': True, 'MIN_CALLS': 2, 'RESET_TIMEOUT': 60}, **kwargs),
+    }
+
+
+def test_opens_when_failure_rate_reached():
+    breaker = CircuitBreaker(min_calls=4, failure_rate=0.5, clock=FakeClock())
+    breaker.record(0.01)
+    breaker.record(0.01, failed=True)
+    breaker.record(0.01)
+    assert breaker.state == CLOSED
+
+    breaker.record(0.01, failed=True)
+    assert breaker.state == OPEN
+    assert breaker.allow_request() is False
+    assert breaker.rejected == 1
+
+
+def test_slow_calls_are_failures():
+    breaker = CircuitBreaker(min_calls=2, slow_call_duration=0.5, clock=FakeClock())
+    breaker.record(0.5)
+    breaker.record(1.0)
+    assert breaker.state == OPEN
+
+
+def test_failures_outside_window_are_forgotten():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=10, min_calls=2, clock=clock)
+    breaker.record(0.01, failed=True)
+    clock.now += 10
+    breaker.record(0.01)
+    assert breaker.state == CLOSED
+    assert (breaker.calls, breaker.failures) == (1, 0)
+
+
+def test_half_open_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=30, clock=clock)
+    breaker.record(0.01, failed=True)
+    assert breaker.allow_request() is False
+
+    # Only a single probe is allowed through once the reset timeout has passed
+    clock.now += 30
+    assert breaker.allow_request() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() is False
+
+    # A failed probe opens the circuit for another reset timeout
+    breaker.record(0.01, failed=True)
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert breaker.allow_request() is False
+
+    clock.now += 1
+    assert breaker.allow_request() is True
+    breaker.record(0.01)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request() is True
+
+
+def test_unrecorded_probe_expires():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=30, clock=clock)
+    breaker.record(0.01, failed=True)
+    clock.now += 30
+    assert breaker.allow_request() is True
+
+    # The probe's request was cancelled so it is never recorded
+    clock.now += 29
+    assert breaker.allow_request() is False
+    clock.now += 1
+    assert breaker.allow_request() is True
+    breaker.record(0.01)
+    assert breaker.state == CLOSED
+
+
+@set_middleware
+def test_fail_open(client, failing_storage):
+    with override_settings(IDEMPOTENCY_KEY=circuit_breaker_settings(MODE='fail-open')):
+        for _ in range(2):
+            response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+            assert response.status_code == status.HTTP_201_CREATED
+            assert response.wsgi_request.idempotency_key_bypassed is True
+        assert failing_storage.retrieve_calls == 2
+
+        # The circuit is now open so the storage is not used at all
+        response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.wsgi_request.idempotency_key_bypassed is True
+        assert failing_storage.retrieve_calls == 2
+
+
+@set_middleware
+def test_fail_closed(client, failing_storage):
+    with override_settings(IDEMPOTENCY_KEY=circuit_breaker_settings(MODE='fail-closed')):
+        for _ in range(3):
+            response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+            assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert failing_storage.retrieve_calls == 2
+
+
+@set_middleware
+def test_store_failure_returns_view_response(client, failing_storage):
+    failing_storage.retrieve_fails = False
+    failing_storage.store_fails = True
+    with override_settings(IDEMPOTENCY_KEY=circuit_breaker_settings(MODE='fail-closed')):
+        response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+        assert response.status_code == status.HTTP_201_CREATED
+
+
+@set_middleware
+def test_store_failure_raises_without_circuit_breaker(client, failing_storage):
+    failing_storage.retrieve_fails = False
+    failing_storage.store_fails = True
+    with override_settings(IDEMPOTENCY_KEY={'STORAGE': {'CLASS': 'tests.tests.test_circuit_breaker.FailingStorage'}}):
+        with pytest.raises(ConnectionError):
+            client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+
+
+@set_middleware
+def test_async_fail_closed(failing_storage):
+    client = AsyncClient()
+
+    async def post():
+        return await client.post('/views/create/', {}, secure=True, **{'idempotency-key': the_key})
+
+    with override_settings(IDEMPOTENCY_KEY=circuit_breaker_settings(MODE='fail-closed')):
+        for _ in range(3):
+            response = async_to_sync(post)()
+            assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert failing_storage.retrieve_calls == 2
+
+
+@pytest.mark.parametrize('mode, status_code', [('fail-open', None), ('fail-closed', status.HTTP_503_SERVICE_UNAVAILABLE)])
+def test_coalesced_duplicate_storage_failure(rf, failing_storage, mode, status_code):
+    settings = circuit_breaker_settings(MODE=mode)
+    settings['STORAGE'] = {
+        'CLASS': 'tests.tests.test_circuit_breaker.FailingPollStorage',
+        'IN_FLIGHT_RESERVATION': True,
+        'COALESCE': True,
+    }
+    with override_settings(IDEMPOTENCY_KEY=settings):
+        obj = IdempotencyKeyMiddleware()
+        requests = [rf.post('/views/create/') for _ in range(2)]
+        for request in requests:
+            request.idempotency_key_cache_name = 'default'
+            request.idempotency_key_manual = False
+
+        assert obj.generate_response(requests[0], the_key) is None
+
+        # The duplicate polls the storage as it would for a request in another process
+        obj.in_flight_events.clear()
+        response = obj.generate_response(requests[1], the_key)
+
+    if status_code is None:
+        assert response is None
+        assert requests[1].idempotency_key_bypassed is True
+    else:
+        assert response.status_code == status_code
+    assert failing_storage.retrieve_calls == 1
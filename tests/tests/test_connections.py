@@ -0,0 +1,112 @@
+import asyncio
+
+from django.test import override_settings
+import pytest
+
+from idempotency_key import connections, deadlines
+from idempotency_key.locks import MultiProcessRedisLock
+from idempotency_key.storage import RedisKeyStorage
+
+redis = pytest.importorskip('redis')
+
+
+def test_connection_pool_shared_by_location():
+    redis1 = connections.get_redis_connection('redis://localhost:6379/1')
+    redis2 = connections.get_redis_connection('redis://localhost:6379/1')
+    redis3 = connections.get_redis_connection('redis://localhost:6379/2')
+    assert redis1.connection_pool is redis2.connection_pool
+    assert redis1.connection_pool is not redis3.connection_pool
+
+
+def test_connection_pool_max_connections():
+    pool = connections.get_connection_pool('redis://localhost:6379/1', max_connections=5)
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == 5
+    assert pool is connections.get_connection_pool('redis://localhost:6379/1', max_connections=5)
+    assert pool is not connections.get_connection_pool('redis://localhost:6379/1')
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'STORAGE': {
+            'LOCATION': 'redis://localhost:6379/1',
+            'MAX_CONNECTIONS': 10,
+            'DEADLINE_MS': 50,
+        },
+        'LOCK': {
+            'LOCATION': 'redis://localhost:6379/1',
+            'MAX_CONNECTIONS': 10,
+        },
+    }
+)
+def test_lock_and_storage_share_connection_pool():
+    lock = MultiProcessRedisLock()
+    storage = RedisKeyStorage()
+    assert lock.redis_obj.connection_pool is storage.redis_obj.connection_pool
+    assert lock.redis_obj.connection_pool.max_connections == 10
+
+
+@override_settings(IDEMPOTENCY_KEY={'STORAGE': {'DEADLINE_MS': 50}})
+def test_command_timeout_limited_by_deadline(rf, mocker):
+    pool = connections.get_connection_pool('redis://localhost:6379/1')
+    connection = pool.make_connection()
+    connection._sock = mocker.Mock()
+    mocker.patch.object(redis.Connection, 'read_response', return_value=b'OK')
+
+    # Without a budget the socket timeout of the connection is left alone
+    assert connection.read_response() == b'OK'
+    connection._sock.settimeout.assert_not_called()
+
+    with deadlines.budget(rf.post('/views/create/')):
+        assert connection.read_response() == b'OK'
+    timeout = connection._sock.settimeout.call_args_list[0][0][0]
+    assert 0 < timeout <= 0.05
+    connection._sock.settimeout.assert_called_with(connection.socket_timeout)
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'redis': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': 'redis://localhost:6379/3',
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        },
+    },
+    IDEMPOTENCY_KEY={
+        'STORAGE': {
+            'DJANGO_REDIS_CACHE': 'redis',
+        },
+        'LOCK': {
+            'DJANGO_REDIS_CACHE': 'redis',
+        },
+    }
+)
+def test_reuse_django_redis_client():
+    pytest.importorskip('django_redis')
+    from django_redis import get_redis_connection
+
+    lock = MultiProcessRedisLock()
+    storage = RedisKeyStorage()
+    assert lock.redis_obj is get_redis_connection('redis')
+    assert storage.redis_obj is get_redis_connection('redis')
+
+
+def test_async_client_per_event_loop():
+    pytest.importorskip('redis.asyncio')
+
+    async def get_clients():
+        return (
+            connections.get_async_redis_connection('redis://localhost:6379/1'),
+            connections.get_async_redis_connection('redis://localhost:6379/1'),
+        )
+
+    client1, client2 = asyncio.run(get_clients())
+    client3, _ = asyncio.run(get_clients())
+    # Clients are shared within an event loop but never across event loops
+    assert client1 is client2
+    assert client1 is not client3
@@ -0,0 +1,178 @@
+import asyncio
+import socket
+import time
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, override_settings
+import pytest
+
+from idempotency_key import deadlines, status
+from idempotency_key.exceptions import DeadlineExceededError
+from idempotency_key.locks import ThreadLock
+from idempotency_key.storage import MemoryKeyStorage, RedisKeyStorage
+from tests.tests.utils import set_middleware
+
+the_key = '7495e32b-709b-4fae-bfd4-2497094bf3fd'
+
+
+class SlowLock(ThreadLock):
+    def acquire(self, *args, **kwargs) -> bool:
+        time.sleep(0.03)
+        return super().acquire(*args, **kwargs)
+
+
+class StoreOnlyRedisStorage(RedisKeyStorage):
+    """
+    Looks up keys without calling the Redis server so that only storing the response uses it.
+    """
+
+    def retrieve_data(self, cache_name, encoded_key):
+        return False, None
+
+
+@pytest.fixture
+def silent_redis_location():
+    """
+    The location of a server that accepts connections but never replies.
+    """
+    pytest.importorskip('redis')
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    yield 'redis://127.0.0.1:{}/1'.format(server.getsockname()[1])
+    server.close()
+
+
+class SlowAsyncStorage(MemoryKeyStorage):
+    async def aretrieve_data(self, cache_name, encoded_key):
+        await asyncio.sleep(1)
+        return await super().aretrieve_data(cache_name, encoded_key)
+
+
+@override_settings(IDEMPOTENCY_KEY={'STORAGE': {'DEADLINE_MS': 50}})
+def test_budget_shared_across_blocks(rf):
+    request = rf.post('/views/create/')
+    with deadlines.budget(request):
+        time.sleep(0.03)
+    assert request.idempotency_key_budget < 0.02
+
+    with deadlines.budget(request):
+        assert deadlines.get_timeout(1.0) < 0.02
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceededError):
+            deadlines.check()
+
+    # The time spent outside the blocks, such as in the view function, is not counted
+    assert deadlines.get_remaining() is None
+    assert request.idempotency_key_budget == 0
+
+
+def test_local_deadline():
+    deadline = deadlines.LocalDeadline()
+    assert deadline.get() is None
+
+    token = deadline.set(1.0)
+    inner_token = deadline.set(2.0)
+    assert deadline.get() == 2.0
+    deadline.reset(inner_token)
+    assert deadline.get() == 1.0
+    deadline.reset(token)
+    assert deadline.get() is None
+
+
+def test_no_budget(rf):
+    request = rf.post('/views/create/')
+    with deadlines.budget(request):
+        assert deadlines.get_remaining() is None
+        assert deadlines.get_timeout(0.1) == 0.1
+        deadlines.check()
+
+
+@override_settings(IDEMPOTENCY_KEY={'STORAGE': {'DEADLINE_MS': 20}})
+def test_wait_for_gives_up(rf):
+    request = rf.post('/views/create/')
+
+    async def slow_call():
+        with deadlines.budget(request):
+            await deadlines.wait_for(asyncio.sleep(1))
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        async_to_sync(slow_call)()
+    assert time.monotonic() - start < 0.5
+
+
+@set_middleware
+@override_settings(IDEMPOTENCY_KEY={'STORAGE': {'DEADLINE_MS': 20}, 'LOCK': {'TIMEOUT': 5}})
+def test_lock_timeout_limited_by_deadline(client):
+    ThreadLock.storage_lock.acquire()
+    try:
+        start = time.monotonic()
+        response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+        assert time.monotonic() - start < 1
+    finally:
+        ThreadLock.storage_lock.release()
+    assert response.status_code == status.HTTP_423_LOCKED
+
+
+@set_middleware
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'STORAGE': {'DEADLINE_MS': 10},
+        'LOCK': {'CLASS': 'tests.tests.test_deadlines.SlowLock'},
+    }
+)
+def test_lookup_deadline_exceeded(client):
+    response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@set_middleware
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'STORAGE': {'CLASS': 'tests.tests.test_deadlines.SlowAsyncStorage', 'DEADLINE_MS': 20},
+    }
+)
+def test_async_lookup_deadline_exceeded():
+    client = AsyncClient()
+
+    async def post():
+        return await client.post('/views/create/', {}, secure=True, **{'idempotency-key': the_key})
+
+    start = time.monotonic()
+    response = async_to_sync(post)()
+    assert time.monotonic() - start < 0.5
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@set_middleware
+def test_redis_lookup_deadline_exceeded(client, silent_redis_location):
+    with override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'idempotency_key.storage.RedisKeyStorage',
+                'LOCATION': silent_redis_location,
+                'DEADLINE_MS': 50,
+            },
+        }
+    ):
+        start = time.monotonic()
+        response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+        assert time.monotonic() - start < 1
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@set_middleware
+def test_redis_store_deadline_exceeded(client, silent_redis_location):
+    with override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'tests.tests.test_deadlines.StoreOnlyRedisStorage',
+                'LOCATION': silent_redis_location,
+                'DEADLINE_MS': 50,
+            },
+        }
+    ):
+        response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+    # The view function has already been called so its response is returned without being stored
+    assert response.status_code == status.HTTP_201_CREATED
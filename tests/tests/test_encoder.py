@@ -1,8 +1,12 @@
+import base64
+import hashlib
 import json
 
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
 import pytest
 
-from idempotency_key.encoders import BasicKeyEncoder
+from idempotency_key.encoders import BasicKeyEncoder, StreamingKeyEncoder
 from idempotency_key.exceptions import MissingIdempotencyKeyError
 
 
@@ -29,3 +33,93 @@ def test_basic_encoder_null_key():
     with pytest.raises(MissingIdempotencyKeyError) as e_info:
         obj.encode_key(request, None)
     assert e_info.value.args[0] == 'Idempotency key cannot be None.'
+
+
+def test_streaming_encoder_same_key_as_basic(rf):
+    data = b'x' * (200 * 1024 + 7)
+    basic_key = BasicKeyEncoder().encode_key(rf.post('/myURL/path/', data, 'application/octet-stream'), 'MyKey')
+
+    request = rf.post('/myURL/path/', data, 'application/octet-stream')
+    enc_key = StreamingKeyEncoder().encode_key(request, 'MyKey')
+    assert enc_key == basic_key
+
+
+@override_settings(
+    FILE_UPLOAD_MAX_MEMORY_SIZE=1024,
+    IDEMPOTENCY_KEY={'ENCODER_CHUNK_SIZE': 100},
+)
+def test_streaming_encoder_leaves_body_readable(rf):
+    data = bytes(range(256)) * 20
+    request = rf.post('/myURL/path/', data, 'application/octet-stream')
+    StreamingKeyEncoder().encode_key(request, 'MyKey')
+
+    # The body was not loaded into memory and can still be streamed by the view
+    assert not hasattr(request, '_body')
+    assert request.read(10) == data[:10]
+    assert request.read() == data[10:]
+
+
+def test_streaming_encoder_body_already_read(rf):
+    data = json.dumps({'key': 'value'}).encode('UTF-8')
+    request = rf.post('/myURL/path/', data, 'application/json')
+    assert request.body == data
+
+    enc_key = StreamingKeyEncoder().encode_key(request, 'MyKey')
+    assert enc_key == BasicKeyEncoder().encode_key(request, 'MyKey')
+    assert request.body == data
+
+
+def test_streaming_encoder_null_key(rf):
+    with pytest.raises(MissingIdempotencyKeyError):
+        StreamingKeyEncoder().encode_key(rf.post('/myURL/path/'), None)
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_ALGORITHM': 'blake2b', 'ENCODER_DIGEST_SIZE': 16}
+)
+def test_blake2b_digest_size(rf):
+    request = rf.post('/myURL/path/', b'body', 'application/octet-stream')
+    enc_key = BasicKeyEncoder().encode_key(request, 'MyKey')
+    assert enc_key == hashlib.blake2b(b'MyKey/myURL/path/POSTbody', digest_size=16).hexdigest()
+    assert len(enc_key) == 32
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_ALGORITHM': 'sha1', 'ENCODER_OUTPUT': 'base64url'}
+)
+def test_sha1_base64url(rf):
+    request = rf.post('/myURL/path/', b'body', 'application/octet-stream')
+    enc_key = StreamingKeyEncoder().encode_key(request, 'MyKey')
+    digest = hashlib.sha1(b'MyKey/myURL/path/POSTbody').digest()
+    assert enc_key == base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+    assert len(enc_key) == 27
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_OUTPUT': 'raw'}
+)
+def test_raw_output(rf):
+    request = rf.post('/myURL/path/', b'body', 'application/octet-stream')
+    enc_key = BasicKeyEncoder().encode_key(request, 'MyKey')
+    assert enc_key == hashlib.sha256(b'MyKey/myURL/path/POSTbody').digest()
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'ENCODER_ALGORITHM': 'xxh3_64'}
+)
+def test_xxhash(rf):
+    xxhash = pytest.importorskip('xxhash')
+    request = rf.post('/myURL/path/', b'body', 'application/octet-stream')
+    enc_key = BasicKeyEncoder().encode_key(request, 'MyKey')
+    assert enc_key == xxhash.xxh3_64(b'MyKey/myURL/path/POSTbody').hexdigest()
+
+
+@pytest.mark.parametrize('encoder_settings', [
+    {'ENCODER_ALGORITHM': 'unknown'},
+    {'ENCODER_ALGORITHM': 'sha256', 'ENCODER_DIGEST_SIZE': 16},
+    {'ENCODER_OUTPUT': 'unknown'},
+])
+def test_invalid_encoder_settings(encoder_settings):
+    with override_settings(IDEMPOTENCY_KEY=encoder_settings):
+        with pytest.raises(ImproperlyConfigured):
+            BasicKeyEncoder()
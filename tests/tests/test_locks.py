@@ -1,7 +1,26 @@
+import os
+import subprocess
+import sys
+import threading
+
 from django.test import override_settings
 import pytest
 
-from idempotency_key import locks
+from idempotency_key import locks, status
+from tests.tests.utils import set_middleware
+
+
+class LegacyLock(locks.IdempotencyKeyLock):
+    """
+    A lock written for the original release(self) signature.
+    """
+    storage_lock = threading.Lock()
+
+    def acquire(self, *args, **kwargs) -> bool:
+        return self.storage_lock.acquire(blocking=True, timeout=0.1)
+
+    def release(self):
+        self.storage_lock.release()
 
 
 def test_single_thread_lock():
@@ -13,6 +32,46 @@ def test_single_thread_lock():
     obj.release()
 
 
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'STRIPES': 2,
+        }
+    }
+)
+def test_striped_thread_lock_same_key():
+    obj = locks.StripedThreadLock()
+    assert len(obj.storage_locks) == 2
+    assert obj.acquire('key1') is True
+    assert obj.acquire('key1') is False
+    obj.release('key1')
+    assert obj.acquire('key1') is True
+    obj.release('key1')
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'STRIPES': 2,
+        }
+    }
+)
+def test_striped_thread_lock_different_stripes():
+    obj = locks.StripedThreadLock()
+    # 'key1' and 'key4' map onto different stripes so holding one must not block the other.
+    assert obj.get_storage_lock('key1') is not obj.get_storage_lock('key4')
+    assert obj.acquire('key1') is True
+    assert obj.acquire('key4') is True
+    obj.release('key1')
+    obj.release('key4')
+
+
+def test_striped_thread_lock_default_stripes():
+    obj = locks.StripedThreadLock()
+    assert len(obj.storage_locks) == 64
+    assert obj.get_storage_lock('key1') is obj.get_storage_lock(b'key1')
+
+
 @override_settings(
     IDEMPOTENCY_KEY={
         'LOCK': {
@@ -67,3 +126,120 @@ def test_multi_process_lock_empty_string_must_be_set():
 def test_multi_process_lock_null_must_be_set():
     with pytest.raises(ValueError):
         locks.MultiProcessRedisLock()
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_obj = fakeredis.FakeRedis()
+    mocker.patch('idempotency_key.connections.get_redis_connection', return_value=redis_obj)
+    yield redis_obj
+    redis_obj.flushall()
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'LOCATION': 'redis://localhost:6379/1',
+        }
+    }
+)
+def test_multi_process_lock_single_name(fake_redis):
+    obj = locks.MultiProcessRedisLock()
+    assert obj.acquire('key1') is True
+    # Without per-key locks every key shares the same lock
+    assert obj.acquire('key2') is False
+    assert fake_redis.exists('MyLock')
+    obj.release('key1')
+    assert not fake_redis.exists('MyLock')
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'LOCATION': 'redis://localhost:6379/1',
+            'PER_KEY': True,
+        }
+    }
+)
+def test_multi_process_lock_per_key(fake_redis):
+    obj = locks.MultiProcessRedisLock()
+    assert obj.acquire('key1') is True
+    assert obj.acquire('key1') is False
+    assert obj.acquire('key2') is True
+    assert fake_redis.exists('idempotency_key_lock:key1')
+    assert fake_redis.exists('idempotency_key_lock:key2')
+    assert not fake_redis.exists('MyLock')
+
+    obj.release('key1')
+    assert not fake_redis.exists('idempotency_key_lock:key1')
+    assert obj.acquire('key1') is True
+    obj.release('key1')
+    obj.release('key2')
+    assert obj.storage_locks == {}
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'LOCATION': 'redis://localhost:6379/1',
+            'PER_KEY': True,
+            'KEY_PREFIX': 'myprefix-',
+        }
+    }
+)
+def test_multi_process_lock_per_key_prefix(fake_redis):
+    obj1 = locks.MultiProcessRedisLock()
+    obj2 = locks.MultiProcessRedisLock()
+    assert obj1.acquire('key1') is True
+    assert fake_redis.exists('myprefix-key1')
+    # A second instance (i.e. another process) is locked out of the same key only
+    assert obj2.acquire('key1') is False
+    assert obj2.acquire('key2') is True
+    obj1.release('key1')
+    obj2.release('key2')
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'LOCATION': 'redis://localhost:6379/1',
+            'PER_KEY': True,
+        }
+    }
+)
+def test_multi_process_lock_per_key_raw_key(fake_redis):
+    obj = locks.MultiProcessRedisLock()
+    raw_key = b'\x00 raw\xff'
+    assert obj.acquire(raw_key) is True
+    assert fake_redis.exists(b'idempotency_key_lock:\x00 raw\xff')
+    obj.release(raw_key)
+    assert not fake_redis.exists(b'idempotency_key_lock:\x00 raw\xff')
+
+
+def test_redis_not_imported_by_thread_locks():
+    """
+    The redis package is optional so it must only be imported when a class that uses it is created.
+    """
+    script = (
+        'import sys\n'
+        'import django\n'
+        'django.setup()\n'
+        'from idempotency_key import utils\n'
+        'import idempotency_key.middleware\n'
+        'utils.get_lock_class()()\n'
+        'utils.get_storage_class()()\n'
+        'print("redis" in sys.modules)\n'
+    )
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings')
+    output = subprocess.check_output([sys.executable, '-c', script], env=env, universal_newlines=True)
+    assert output.strip() == 'False'
+
+
+@set_middleware
+@override_settings(IDEMPOTENCY_KEY={'LOCK': {'CLASS': 'tests.tests.test_locks.LegacyLock'}})
+def test_lock_without_key_argument_is_released(client):
+    for key in ('key1', 'key2'):
+        response = client.post('/views/create/', {}, secure=True, HTTP_IDEMPOTENCY_KEY=key)
+        assert response.status_code == status.HTTP_201_CREATED
+    assert LegacyLock.storage_lock.locked() is False
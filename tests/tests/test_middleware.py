@@ -8,7 +8,7 @@ import pytest
 from idempotency_key import status
 from idempotency_key.encoders import IdempotencyKeyEncoder
 from idempotency_key.exceptions import DecoratorsMutuallyExclusiveError
-from idempotency_key.storage import IdempotencyKeyStorage
+from idempotency_key.storage import CacheKeyStorage, IdempotencyKeyStorage
 from tests.tests.utils import for_all_methods
 
 
@@ -445,3 +445,166 @@ class TestMiddlewareInclusive:
         assert request.idempotency_key_manual is False
         assert request.idempotency_key_encoded_key == '1f4bc93e1a614e35350605b01133d77c1d4b15dd515e40fc6599ca3ff137143d'
         assert request.idempotency_key_cache_name == 'FiveMinuteCache'
+
+    @override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'idempotency_key.storage.CacheKeyStorage',
+                'IN_FLIGHT_RESERVATION': True,
+            },
+        },
+    )
+    def test_in_flight_reservation(self, client):
+        """
+        While a request with the same key is still being processed duplicates must not run the view.
+        """
+        caches['default'].clear()
+        encoded_key = '1f4bc93e1a614e35350605b01133d77c1d4b15dd515e40fc6599ca3ff137143d'
+        voucher_data = {
+            'id': 1,
+            'name': 'myvoucher0',
+            'internal_name': 'myvoucher0',
+        }
+
+        # Simulate another request that has reserved the key and is still running the view
+        CacheKeyStorage().reserve_key('default', encoded_key)
+
+        response = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response.status_code == status.HTTP_423_LOCKED
+
+        CacheKeyStorage().release_key('default', encoded_key)
+
+        response = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response.status_code == status.HTTP_201_CREATED
+        request = response.wsgi_request
+        assert request.idempotency_key_encoded_key == encoded_key
+
+        # The reservation has been replaced by the stored response
+        response2 = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response2.status_code == status.HTTP_409_CONFLICT
+        assert response2.wsgi_request.idempotency_key_exists is True
+
+    @override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'idempotency_key.storage.CacheKeyStorage',
+                'IN_FLIGHT_RESERVATION': True,
+                'STORE_ON_STATUSES': [status.HTTP_207_MULTI_STATUS],
+            },
+        },
+    )
+    def test_in_flight_reservation_released_when_not_stored(self, client):
+        caches['default'].clear()
+        voucher_data = {
+            'id': 1,
+            'name': 'myvoucher0',
+            'internal_name': 'myvoucher0',
+        }
+
+        response = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response2 = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response2.status_code == status.HTTP_201_CREATED
+        request = response2.wsgi_request
+        assert request.idempotency_key_exists is False
+        assert '1f4bc93e1a614e35350605b01133d77c1d4b15dd515e40fc6599ca3ff137143d' not in caches['default']
+
+    @override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'idempotency_key.storage.CacheKeyStorage',
+                'SERIALIZER_CLASS': 'idempotency_key.serializers.CompactResponseSerializer',
+            },
+        },
+    )
+    def test_middleware_cache_storage_compact_serializer(self, client):
+        caches['default'].clear()
+        voucher_data = {
+            'id': 1,
+            'name': 'myvoucher0',
+            'internal_name': 'myvoucher0',
+        }
+
+        response = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response2 = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response2.status_code == status.HTTP_409_CONFLICT
+        assert response2.content == response.content
+        assert response2['Content-Type'] == response['Content-Type']
+        request = response2.wsgi_request
+        assert request.idempotency_key_exists is True
+
+    @override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'idempotency_key.storage.RedisKeyStorage',
+                'IN_FLIGHT_RESERVATION': True,
+            },
+        },
+    )
+    def test_middleware_redis_storage(self, client, mocker):
+        fakeredis = pytest.importorskip('fakeredis')
+        redis_obj = fakeredis.FakeRedis()
+        redis_obj.flushall()
+        mocker.patch('idempotency_key.connections.get_redis_connection', return_value=redis_obj)
+        voucher_data = {
+            'id': 1,
+            'name': 'myvoucher0',
+            'internal_name': 'myvoucher0',
+        }
+
+        response = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response2 = client.post(self.urls['create'], voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=self.the_key)
+        assert response2.status_code == status.HTTP_409_CONFLICT
+        request = response2.wsgi_request
+        assert request.idempotency_key_exists is True
+        assert redis_obj.exists(
+            'idempotency_key:default:1f4bc93e1a614e35350605b01133d77c1d4b15dd515e40fc6599ca3ff137143d'
+        )
+
+
+def test_flags_resolved_once_per_view_and_method(mocker, rf):
+    """
+    The decorator flags of a view function are only looked up the first time it is called with each request method.
+    """
+    from idempotency_key.middleware import IdempotencyKeyMiddleware
+    from tests import views
+
+    middleware = IdempotencyKeyMiddleware(get_response=lambda request: None)
+    spy = mocker.spy(middleware, '_get_flags_from_callback')
+
+    for _ in range(3):
+        request = rf.post('/views/create-manual/')
+        middleware._set_flags_from_callback(request, views.create_manual)
+        assert request.idempotency_key_exempt is False
+        assert request.idempotency_key_manual is True
+        assert request.idempotency_key_cache_name == 'default'
+
+    assert spy.call_count == 1
+
+    request = rf.put('/views/create-manual/')
+    middleware._set_flags_from_callback(request, views.create_manual)
+    assert spy.call_count == 2
+
+
+def test_cached_flags_use_current_default_cache_name(rf):
+    """
+    Views without a cache name still pick up changes to the CACHE_NAME setting after their flags are cached.
+    """
+    from idempotency_key.middleware import IdempotencyKeyMiddleware
+    from tests import views
+
+    middleware = IdempotencyKeyMiddleware(get_response=lambda request: None)
+
+    request = rf.post('/views/create/')
+    middleware._set_flags_from_callback(request, views.create)
+    assert request.idempotency_key_cache_name == 'default'
+
+    with override_settings(IDEMPOTENCY_KEY={'STORAGE': {'CACHE_NAME': 'FiveMinuteCache'}}):
+        request = rf.post('/views/create/')
+        middleware._set_flags_from_callback(request, views.create)
+        assert request.idempotency_key_cache_name == 'FiveMinuteCache'
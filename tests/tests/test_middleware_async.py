@@ -0,0 +1,185 @@
+import asyncio
+import pickle
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, override_settings
+import pytest
+
+from idempotency_key import locks, status
+from idempotency_key.middleware import IdempotencyKeyMiddleware, iscoroutinefunction
+from idempotency_key.storage import IN_FLIGHT, MemoryKeyStorage, RedisKeyStorage
+from tests.tests.utils import set_middleware
+
+the_key = '7495e32b-709b-4fae-bfd4-2497094bf3fd'
+
+voucher_data = {
+    'id': 1,
+    'name': 'myvoucher0',
+    'internal_name': 'myvoucher0',
+}
+
+
+@pytest.fixture
+def fake_async_redis(mocker):
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    mocker.patch('idempotency_key.connections.get_redis_connection', return_value=fakeredis.FakeRedis(server=server))
+    # A new client is used for every call as each test runs its coroutines on a new event loop
+    mocker.patch(
+        'idempotency_key.connections.get_async_redis_connection',
+        side_effect=lambda *args, **kwargs: fakeredis.FakeAsyncRedis(server=server),
+    )
+    yield fakeredis.FakeRedis(server=server)
+
+
+def test_middleware_sync_mode():
+    middleware = IdempotencyKeyMiddleware(lambda request: None)
+    assert iscoroutinefunction(middleware) is False
+    assert middleware.process_view == middleware.__class__.process_view.__get__(middleware)
+
+
+def test_middleware_async_mode():
+    async def get_response(request):
+        return None
+
+    middleware = IdempotencyKeyMiddleware(get_response)
+    assert iscoroutinefunction(middleware) is True
+    assert iscoroutinefunction(middleware.process_view) is True
+
+
+@set_middleware
+def test_middleware_async_duplicate_request():
+    client = AsyncClient()
+
+    async def post():
+        # The async test client takes the raw ASGI header name
+        return await client.post('/views/create/', voucher_data, secure=True, **{'idempotency-key': the_key})
+
+    response = async_to_sync(post)()
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response2 = async_to_sync(post)()
+    assert response2.status_code == status.HTTP_409_CONFLICT
+    request = response2.asgi_request
+    assert request.idempotency_key_exists is True
+    assert request.idempotency_key_exempt is False
+    assert request.idempotency_key_encoded_key == '1f4bc93e1a614e35350605b01133d77c1d4b15dd515e40fc6599ca3ff137143d'
+
+
+@set_middleware
+def test_middleware_async_missing_key():
+    client = AsyncClient()
+
+    async def post():
+        return await client.post('/views/create/', voucher_data, secure=True)
+
+    response = async_to_sync(post)()
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_memory_storage_async():
+    obj = MemoryKeyStorage()
+
+    async def run():
+        assert await obj.aretrieve_or_reserve('default', 'key') == (False, None)
+        assert await obj.aretrieve_data('default', 'key') == (True, IN_FLIGHT)
+        assert await obj.areserve_key('default', 'key') is False
+        await obj.arelease_key('default', 'key')
+        await obj.astore_data('default', 'key', 'value')
+        assert await obj.aretrieve_data('default', 'key') == (True, 'value')
+
+    async_to_sync(run)()
+
+
+def test_thread_lock_async():
+    obj = locks.ThreadLock()
+
+    async def run():
+        assert await obj.aacquire() is True
+        # Held by this request so the second acquire times out without blocking the event loop
+        assert await obj.aacquire() is False
+        await obj.arelease()
+        assert await obj.aacquire() is True
+        await obj.arelease()
+
+    async_to_sync(run)()
+
+
+def test_thread_lock_async_waits_for_release():
+    obj = locks.ThreadLock()
+
+    async def holder():
+        assert await obj.aacquire() is True
+        await asyncio.sleep(0.02)
+        await obj.arelease()
+
+    async def waiter():
+        await asyncio.sleep(0.005)
+        return await obj.aacquire()
+
+    async def run():
+        _, acquired = await asyncio.gather(holder(), waiter())
+        assert acquired is True
+        await obj.arelease()
+
+    async_to_sync(run)()
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'STRIPES': 2,
+        }
+    }
+)
+def test_striped_thread_lock_async():
+    obj = locks.StripedThreadLock()
+
+    async def run():
+        assert await obj.aacquire('key1') is True
+        assert await obj.aacquire('key1') is False
+        assert await obj.aacquire('key4') is True
+        await obj.arelease('key1')
+        await obj.arelease('key4')
+
+    async_to_sync(run)()
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'LOCK': {
+            'CLASS': 'idempotency_key.locks.MultiProcessRedisLock',
+            'PER_KEY': True,
+        }
+    }
+)
+def test_redis_lock_async_per_key(fake_async_redis):
+    obj = locks.MultiProcessRedisLock()
+
+    async def run():
+        assert await obj.aacquire('key1') is True
+        assert await obj.aacquire('key1') is False
+        assert await obj.aacquire('key2') is True
+        assert fake_async_redis.exists('idempotency_key_lock:key1')
+        await obj.arelease('key1')
+        await obj.arelease('key2')
+        assert not fake_async_redis.exists('idempotency_key_lock:key1')
+
+    async_to_sync(run)()
+
+
+def test_redis_storage_async(fake_async_redis):
+    obj = RedisKeyStorage()
+
+    async def run():
+        assert await obj.aretrieve_or_reserve('default', 'key') == (False, None)
+        assert fake_async_redis.get('idempotency_key:default:key') == IN_FLIGHT
+        assert await obj.aretrieve_or_reserve('default', 'key') == (True, IN_FLIGHT)
+        await obj.arelease_key('default', 'key')
+        assert await obj.aretrieve_data('default', 'key') == (False, None)
+        assert await obj.areserve_key('default', 'key') is True
+        await obj.astore_data('default', 'key', 'value')
+        assert fake_async_redis.get('idempotency_key:default:key') == pickle.dumps('value')
+        assert await obj.aretrieve_or_reserve('default', 'key') == (True, 'value')
+
+    async_to_sync(run)()
@@ -0,0 +1,130 @@
+import threading
+
+from django.db import connection, transaction
+from django.test import override_settings
+import pytest
+
+from idempotency_key import status
+from idempotency_key.storage import MemoryKeyStorage
+from tests.tests.utils import set_middleware
+
+voucher_data = {
+    'id': 1,
+    'name': 'myvoucher0',
+    'internal_name': 'myvoucher0',
+}
+
+
+class RecordingStorage(MemoryKeyStorage):
+    stored = []
+
+    def store_data(self, cache_name, encoded_key, response):
+        RecordingStorage.stored.append(encoded_key)
+        super().store_data(cache_name, encoded_key, response)
+
+
+@pytest.fixture
+def recording_storage():
+    RecordingStorage.stored = []
+    with override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'tests.tests.test_middleware_store_on_commit.RecordingStorage',
+                'STORE_ON_COMMIT': True,
+            },
+        }
+    ):
+        yield RecordingStorage
+
+
+def post(client, key):
+    return client.post('/views/create/', voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=key)
+
+
+@pytest.mark.django_db(transaction=True)
+@set_middleware
+def test_stored_after_commit(client, recording_storage):
+    with transaction.atomic():
+        assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+        assert post(client, 'key2').status_code == status.HTTP_201_CREATED
+        assert recording_storage.stored == []
+        # Both responses are stored by a single callback
+        assert len(connection.run_on_commit) == 1
+
+    assert len(recording_storage.stored) == 2
+    assert post(client, 'key1').status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.django_db(transaction=True)
+@set_middleware
+def test_not_stored_after_rollback(client, recording_storage):
+    with transaction.atomic():
+        assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+        transaction.set_rollback(True)
+    assert recording_storage.stored == []
+
+    # A new batch is started for the next transaction
+    with transaction.atomic():
+        assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+    assert len(recording_storage.stored) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+@set_middleware
+def test_reservation_released_after_rollback(client, recording_storage):
+    with override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'tests.tests.test_middleware_store_on_commit.RecordingStorage',
+                'STORE_ON_COMMIT': True,
+                'IN_FLIGHT_RESERVATION': True,
+            },
+        }
+    ):
+        with transaction.atomic():
+            assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+            # The key stays reserved until the transaction commits
+            assert post(client, 'key1').status_code == status.HTTP_423_LOCKED
+            transaction.set_rollback(True)
+
+        # The retry runs the view instead of waiting for the reservation to expire
+        assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+        assert len(recording_storage.stored) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+@set_middleware
+def test_reservation_released_for_retry_in_another_thread(client, recording_storage):
+    def post_in_thread(key):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(post(client, key).status_code))
+        thread.start()
+        thread.join(timeout=5)
+        return results[0]
+
+    with override_settings(
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'CLASS': 'tests.tests.test_middleware_store_on_commit.RecordingStorage',
+                'STORE_ON_COMMIT': True,
+                'IN_FLIGHT_RESERVATION': True,
+            },
+        }
+    ):
+        with transaction.atomic():
+            assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+            transaction.set_rollback(True)
+
+        # The rollback is only noticed by the thread whose connection ran the transaction, see the README
+        assert post_in_thread('key1') == status.HTTP_423_LOCKED
+
+        # Once that thread processes another request the key is released for retries in any thread
+        assert post(client, 'key2').status_code == status.HTTP_201_CREATED
+        assert post_in_thread('key1') == status.HTTP_201_CREATED
+
+
+@pytest.mark.django_db(transaction=True)
+@set_middleware
+def test_stored_immediately_outside_transaction(client, recording_storage):
+    assert post(client, 'key1').status_code == status.HTTP_201_CREATED
+    assert len(recording_storage.stored) == 1
@@ -0,0 +1,95 @@
+import pickle
+
+from django.http import HttpResponse, StreamingHttpResponse
+import pytest
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from idempotency_key import status
+from idempotency_key.serializers import CompactResponseSerializer, PickleSerializer
+
+
+def rendered_drf_response():
+    class MyView(APIView):
+        renderer_classes = (JSONRenderer,)
+
+        def post(self, request, *args, **kwargs):
+            return Response(status=status.HTTP_201_CREATED, data={'id': 1, 'name': 'myvoucher0'})
+
+    request = APIRequestFactory().post('/views/create/', {})
+    response = MyView.as_view()(request)
+    return response.render()
+
+
+def test_pickle_serializer():
+    obj = PickleSerializer()
+    data = obj.serialize('value')
+    assert data == pickle.dumps('value')
+    assert obj.deserialize(data) == 'value'
+
+
+def test_compact_serializer_http_response():
+    response = HttpResponse(b'{"key": "value"}', status=status.HTTP_201_CREATED, content_type='application/json')
+    response['X-My-Header'] = 'my value'
+
+    obj = CompactResponseSerializer()
+    data = obj.serialize(response)
+    assert data[0] == CompactResponseSerializer.VERSION
+
+    replayed = obj.deserialize(data)
+    assert isinstance(replayed, HttpResponse)
+    assert replayed.status_code == status.HTTP_201_CREATED
+    assert replayed.content == b'{"key": "value"}'
+    assert replayed['Content-Type'] == 'application/json'
+    assert replayed['X-My-Header'] == 'my value'
+    assert list(replayed.items()) == list(response.items())
+
+
+def test_compact_serializer_cookies():
+    response = HttpResponse(b'created', status=status.HTTP_201_CREATED)
+    response.set_cookie('session', 'abc', max_age=3600, path='/api/', secure=True, httponly=True, samesite='Lax')
+    response.set_cookie('theme', 'dark')
+
+    obj = CompactResponseSerializer()
+    replayed = obj.deserialize(obj.serialize(response))
+    assert set(replayed.cookies) == {'session', 'theme'}
+    assert replayed.cookies['session'].OutputString() == response.cookies['session'].OutputString()
+    assert replayed.cookies['theme'].value == 'dark'
+    # The cookies are not replayed as ordinary headers
+    assert not replayed.has_header('Set-Cookie')
+
+
+def test_compact_serializer_drf_response():
+    response = rendered_drf_response()
+
+    obj = CompactResponseSerializer()
+    data = obj.serialize(response)
+    replayed = obj.deserialize(data)
+    assert replayed.status_code == status.HTTP_201_CREATED
+    assert replayed.content == response.content
+    assert replayed['Content-Type'] == response['Content-Type']
+
+    # None of the renderer, data or request state is stored
+    assert len(data) < len(pickle.dumps(response))
+
+
+def test_compact_serializer_empty_response():
+    obj = CompactResponseSerializer()
+    replayed = obj.deserialize(obj.serialize(HttpResponse(status=status.HTTP_204_NO_CONTENT)))
+    assert replayed.status_code == status.HTTP_204_NO_CONTENT
+    assert replayed.content == b''
+
+
+def test_compact_serializer_unknown_version():
+    obj = CompactResponseSerializer()
+    data = obj.serialize(HttpResponse())
+    with pytest.raises(ValueError):
+        obj.deserialize(b'\xff' + data[1:])
+
+
+def test_compact_serializer_streaming_response():
+    obj = CompactResponseSerializer()
+    with pytest.raises(ValueError):
+        obj.serialize(StreamingHttpResponse(iter([b'value'])))
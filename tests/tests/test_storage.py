@@ -1,10 +1,33 @@
 import pickle
 
 from django.core.cache import caches, InvalidCacheBackendError
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
 from django.test import override_settings
 import pytest
 
-from idempotency_key.storage import MemoryKeyStorage, CacheKeyStorage
+from idempotency_key.serializers import CompactResponseSerializer
+from idempotency_key.storage import (
+    get_approximate_size, IN_FLIGHT, MemoryKeyStorage, CacheKeyStorage, TwoTierKeyStorage
+)
+
+
+class CountingLocMemCache(LocMemCache):
+    """
+    A custom cache backend that records the calls made to it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def get(self, *args, **kwargs):
+        self.calls.append('get')
+        return super().get(*args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        self.calls.append('has_key')
+        return super().has_key(*args, **kwargs)
 
 
 def test_memory_storage_store():
@@ -43,6 +66,182 @@ def test_memory_storage_retrieve_no_key():
     assert value is None
 
 
+def test_memory_storage_reserve():
+    cache_name = 'default'
+    obj = MemoryKeyStorage()
+    assert obj.reserve_key(cache_name, 'key') is True
+    assert obj.reserve_key(cache_name, 'key') is False
+    assert obj.retrieve_data(cache_name, 'key') == (True, IN_FLIGHT)
+
+    # Storing the response replaces the reservation
+    obj.store_data(cache_name, 'key', 'value')
+    assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+
+    # Stored responses are never released
+    obj.release_key(cache_name, 'key')
+    assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+
+
+def test_memory_storage_release():
+    cache_name = 'default'
+    obj = MemoryKeyStorage()
+    assert obj.reserve_key(cache_name, 'key') is True
+    obj.release_key(cache_name, 'key')
+    assert obj.retrieve_data(cache_name, 'key') == (False, None)
+    assert obj.reserve_key(cache_name, 'key') is True
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'MEMORY_OPTIONS': {'default': {'MAX_ENTRIES': 2}}}}
+)
+def test_memory_storage_max_entries():
+    cache_name = 'default'
+    obj = MemoryKeyStorage()
+    obj.store_data(cache_name, 'key1', 'value1')
+    obj.store_data(cache_name, 'key2', 'value2')
+
+    # key1 becomes the most recently used so key2 is evicted next
+    assert obj.retrieve_data(cache_name, 'key1') == (True, 'value1')
+    obj.store_data(cache_name, 'key3', 'value3')
+
+    assert obj.retrieve_data(cache_name, 'key1') == (True, 'value1')
+    assert obj.retrieve_data(cache_name, 'key2') == (False, None)
+    assert obj.retrieve_data(cache_name, 'key3') == (True, 'value3')
+    assert len(obj.idempotency_key_cache_data[cache_name]) == 2
+
+    # Other cache names are not limited
+    for i in range(5):
+        obj.store_data('other', 'key{}'.format(i), 'value')
+    assert len(obj.idempotency_key_cache_data['other']) == 5
+
+
+def test_memory_storage_does_not_evict_reservations():
+    cache_name = 'default'
+    obj = MemoryKeyStorage(options={'MAX_ENTRIES': 2})
+    assert obj.reserve_key(cache_name, 'lead') is True
+    obj.store_data(cache_name, 'key1', 'value1')
+    obj.store_data(cache_name, 'key2', 'value2')
+
+    # The least recently used response is evicted instead of the reservation
+    assert obj.retrieve_data(cache_name, 'lead') == (True, IN_FLIGHT)
+    assert obj.reserve_key(cache_name, 'lead') is False
+    assert obj.retrieve_data(cache_name, 'key1') == (False, None)
+
+    # The limit is exceeded rather than evicting reservations when there is nothing else left
+    assert obj.reserve_key(cache_name, 'other') is True
+    assert obj.reserve_key(cache_name, 'third') is True
+    assert all(obj.retrieve_data(cache_name, key) == (True, IN_FLIGHT) for key in ('lead', 'other', 'third'))
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'MEMORY_OPTIONS': {'default': {'MAX_BYTES': 10}}}}
+)
+def test_memory_storage_max_bytes():
+    cache_name = 'default'
+    obj = MemoryKeyStorage()
+    obj.store_data(cache_name, 'key1', b'1234')
+    obj.store_data(cache_name, 'key2', b'1234')
+    assert obj.idempotency_key_cache_total_sizes[cache_name] == 8
+
+    obj.store_data(cache_name, 'key3', b'1234')
+    assert obj.retrieve_data(cache_name, 'key1') == (False, None)
+    assert obj.idempotency_key_cache_total_sizes[cache_name] == 8
+
+    # Replacing a value does not count it twice
+    obj.store_data(cache_name, 'key3', b'123456')
+    assert obj.idempotency_key_cache_total_sizes[cache_name] == 10
+    assert obj.retrieve_data(cache_name, 'key2') == (True, b'1234')
+
+    # A value larger than the budget is not kept
+    obj.store_data(cache_name, 'key4', b'12345678901')
+    assert obj.idempotency_key_cache_data[cache_name] == {}
+    assert obj.idempotency_key_cache_total_sizes[cache_name] == 0
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'MEMORY_OPTIONS': {'default': {'TIMEOUT': 10}}}}
+)
+def test_memory_storage_timeout(mocker):
+    mock_time = mocker.patch('idempotency_key.storage.time')
+    mock_time.monotonic.return_value = 100
+    cache_name = 'default'
+    obj = MemoryKeyStorage()
+    obj.store_data(cache_name, 'key1', 'value1')
+
+    mock_time.monotonic.return_value = 105
+    obj.store_data(cache_name, 'key2', 'value2')
+    assert obj.retrieve_data(cache_name, 'key1') == (True, 'value1')
+
+    mock_time.monotonic.return_value = 110
+    assert obj.retrieve_data(cache_name, 'key1') == (False, None)
+    assert obj.retrieve_data(cache_name, 'key2') == (True, 'value2')
+
+    # Storing the key again restarts its timeout
+    obj.store_data(cache_name, 'key2', 'value2')
+    mock_time.monotonic.return_value = 116
+    assert obj.retrieve_data(cache_name, 'key2') == (True, 'value2')
+    mock_time.monotonic.return_value = 120
+    assert obj.retrieve_data(cache_name, 'key2') == (False, None)
+    assert obj.idempotency_key_cache_expiry_heaps[cache_name] == []
+    assert obj.idempotency_key_cache_total_sizes[cache_name] == 0
+
+
+def test_memory_storage_expiry_heap_bounded_by_entries():
+    cache_name = 'default'
+    obj = MemoryKeyStorage(options={'MAX_ENTRIES': 10, 'TIMEOUT': 300})
+    for i in range(1000):
+        obj.store_data(cache_name, 'key{}'.format(i), 'value')
+
+    assert len(obj.idempotency_key_cache_data[cache_name]) == 10
+    assert len(obj.idempotency_key_cache_expiry_heaps[cache_name]) <= 2 * 10 + 16
+    assert obj.retrieve_data(cache_name, 'key999') == (True, 'value')
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'TIMEOUT': 30,
+        },
+        'no_timeout': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'TIMEOUT': None,
+        },
+    },
+)
+def test_memory_storage_timeout_from_caches(mocker):
+    mock_time = mocker.patch('idempotency_key.storage.time')
+    mock_time.monotonic.return_value = 100
+    obj = MemoryKeyStorage()
+    for cache_name in ('default', 'no_timeout', 'not_a_cache'):
+        obj.store_data(cache_name, 'key', 'value')
+
+    mock_time.monotonic.return_value = 130
+    assert obj.retrieve_data('default', 'key') == (False, None)
+    assert obj.retrieve_data('no_timeout', 'key') == (True, 'value')
+    assert obj.retrieve_data('not_a_cache', 'key') == (True, 'value')
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'IN_FLIGHT_TTL': 5}}
+)
+def test_memory_storage_reservation_timeout(mocker):
+    mock_time = mocker.patch('idempotency_key.storage.time')
+    mock_time.monotonic.return_value = 100
+    cache_name = 'default'
+    obj = MemoryKeyStorage()
+    assert obj.reserve_key(cache_name, 'key') is True
+
+    mock_time.monotonic.return_value = 105
+    assert obj.retrieve_data(cache_name, 'key') == (False, None)
+    assert obj.reserve_key(cache_name, 'key') is True
+
+
+def test_memory_storage_response_size():
+    response = HttpResponse(b'value', content_type='text/plain')
+    assert get_approximate_size(response) == len(b'value') + len('Content-Type') + len('text/plain')
+
+
 class TestDefaultCache:
     @override_settings(
         CACHES={
@@ -62,6 +261,31 @@ class TestDefaultCache:
         assert 'key' in cache
         assert cache.get('key') == pickle.dumps('value')
 
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'a1394848-7dba-456b-93c5-5959bd293dc6',
+            }
+        }
+    )
+    def test_cache_storage_reserve_and_release(self):
+        obj = CacheKeyStorage()
+        cache_name = 'default'
+        caches[cache_name].clear()
+        assert obj.reserve_key(cache_name, 'key') is True
+        assert obj.reserve_key(cache_name, 'key') is False
+        assert obj.retrieve_data(cache_name, 'key') == (True, IN_FLIGHT)
+
+        obj.release_key(cache_name, 'key')
+        assert obj.retrieve_data(cache_name, 'key') == (False, None)
+
+        assert obj.reserve_key(cache_name, 'key') is True
+        obj.store_data(cache_name, 'key', 'value')
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+        obj.release_key(cache_name, 'key')
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+
     @override_settings(
         CACHES={
             'default': {
@@ -77,6 +301,141 @@ class TestDefaultCache:
         with pytest.raises(InvalidCacheBackendError):
             obj.validate_storage(cache_name)
 
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'tests.tests.test_storage.CountingLocMemCache',
+                'LOCATION': '0b6f5a8e-8a4f-4b39-9a57-58d6a6c0c3a5',
+            }
+        }
+    )
+    def test_cache_storage_retrieve_single_call(self):
+        obj = CacheKeyStorage()
+        cache_name = 'default'
+        cache = caches[cache_name]
+        cache.clear()
+
+        assert obj.retrieve_data(cache_name, 'key') == (False, None)
+        assert cache.calls == ['get']
+
+        obj.store_data(cache_name, 'key', 'value')
+        cache.calls.clear()
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+        assert cache.calls == ['get']
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'a1394848-7dba-456b-93c5-5959bd293dc6',
+            }
+        },
+        IDEMPOTENCY_KEY={
+            'STORAGE': {
+                'SERIALIZER_CLASS': 'idempotency_key.serializers.CompactResponseSerializer',
+            },
+        },
+    )
+    def test_cache_storage_compact_serializer(self):
+        obj = CacheKeyStorage()
+        cache_name = 'default'
+        caches[cache_name].clear()
+        obj.store_data(cache_name, 'key', HttpResponse(b'value', status=201))
+
+        assert caches[cache_name].get('key') == CompactResponseSerializer().serialize(HttpResponse(b'value', status=201))
+        key_exists, response = obj.retrieve_data(cache_name, 'key')
+        assert key_exists is True
+        assert response.status_code == 201
+        assert response.content == b'value'
+
+
+class TestTwoTierCache:
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'tests.tests.test_storage.CountingLocMemCache',
+                'LOCATION': '3b0a5c0e-0f0b-4f5e-8a51-2d4a6e0f9f4b',
+            }
+        }
+    )
+    def test_two_tier_storage_write_through(self):
+        obj = TwoTierKeyStorage()
+        cache_name = 'default'
+        cache = caches[cache_name]
+        cache.clear()
+
+        obj.store_data(cache_name, 'key', 'value')
+        assert cache.get('key') == pickle.dumps('value')
+
+        # Served from the process without going to the cache
+        cache.calls.clear()
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+        assert cache.calls == []
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'tests.tests.test_storage.CountingLocMemCache',
+                'LOCATION': '3b0a5c0e-0f0b-4f5e-8a51-2d4a6e0f9f4b',
+            }
+        }
+    )
+    def test_two_tier_storage_read_through(self):
+        cache_name = 'default'
+        cache = caches[cache_name]
+        cache.clear()
+        # Stored by another process
+        CacheKeyStorage().store_data(cache_name, 'key', 'value')
+
+        obj = TwoTierKeyStorage()
+        cache.calls.clear()
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+        assert cache.calls == ['get']
+
+        assert obj.retrieve_data(cache_name, 'missing') == (False, None)
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': '3b0a5c0e-0f0b-4f5e-8a51-2d4a6e0f9f4b',
+            }
+        },
+        IDEMPOTENCY_KEY={'STORAGE': {'LOCAL_OPTIONS': {'TIMEOUT': 5}}},
+    )
+    def test_two_tier_storage_local_timeout(self, mocker):
+        mock_time = mocker.patch('idempotency_key.storage.time')
+        mock_time.monotonic.return_value = 100
+        cache_name = 'default'
+        caches[cache_name].clear()
+        obj = TwoTierKeyStorage()
+        obj.store_data(cache_name, 'key', 'value')
+
+        mock_time.monotonic.return_value = 105
+        assert obj.local_storage.retrieve_data(cache_name, 'key') == (False, None)
+        # Still available from the django cache
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': '3b0a5c0e-0f0b-4f5e-8a51-2d4a6e0f9f4b',
+            }
+        }
+    )
+    def test_two_tier_storage_reservation_not_kept_locally(self):
+        cache_name = 'default'
+        caches[cache_name].clear()
+        obj = TwoTierKeyStorage()
+        assert obj.reserve_key(cache_name, 'key') is True
+        assert obj.retrieve_data(cache_name, 'key') == (True, IN_FLIGHT)
+        assert obj.local_storage.retrieve_data(cache_name, 'key') == (False, None)
+
+        obj.store_data(cache_name, 'key', 'value')
+        assert obj.retrieve_data(cache_name, 'key') == (True, 'value')
+
 
 class TestNamedCache:
     @override_settings(
@@ -1,13 +1,25 @@
+import threading
+import time
+
+from django.http import HttpResponse
+from django.test import override_settings
+
 from idempotency_key import status
 from idempotency_key.middleware import IdempotencyKeyMiddleware
 
 
-def test_storage_when_locked_returns_423():
-    class Request:
-        idempotency_key_manual = False
-        idempotency_key_cache_name = 'default'
-        pass
+class Request:
+    idempotency_key_manual = False
+    idempotency_key_cache_name = 'default'
+    idempotency_key_done = True
+    idempotency_key_exempt = False
+    method = 'POST'
+
+    def __init__(self, encoded_key=None):
+        self.idempotency_key_encoded_key = encoded_key
 
+
+def test_storage_when_locked_returns_423():
     request = Request()
     obj = IdempotencyKeyMiddleware()
     lock = obj.storage_lock.acquire(blocking=True, timeout=-1)
@@ -20,3 +32,75 @@ def test_storage_when_locked_returns_423():
     # Now that the lock is open, running the function again should return None because no key will exist in the cache
     response = obj.generate_response(request, 'mykey', lock=True)
     assert response is None
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'IN_FLIGHT_RESERVATION': True}}
+)
+def test_in_flight_duplicate_returns_423():
+    obj = IdempotencyKeyMiddleware()
+    assert obj.generate_response(Request('mykey'), 'mykey') is None
+
+    response = obj.generate_response(Request('mykey'), 'mykey')
+    assert response.status_code == status.HTTP_423_LOCKED
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'IN_FLIGHT_RESERVATION': True, 'COALESCE': True}}
+)
+def test_coalesced_duplicate_receives_stored_response():
+    obj = IdempotencyKeyMiddleware()
+    leader = Request('mykey')
+    assert obj.generate_response(leader, 'mykey') is None
+    assert leader.idempotency_key_reserved is True
+
+    duplicate = Request('mykey')
+    results = []
+    thread = threading.Thread(target=lambda: results.append(obj.generate_response(duplicate, 'mykey')))
+    thread.start()
+
+    # Give the duplicate time to start waiting on the leader
+    time.sleep(0.05)
+    response = obj.process_response(leader, HttpResponse(status=status.HTTP_201_CREATED))
+    thread.join(timeout=5)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert results[0].status_code == status.HTTP_409_CONFLICT
+    assert duplicate.idempotency_key_exists is True
+    assert obj.in_flight_events == {}
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'IN_FLIGHT_RESERVATION': True, 'COALESCE': True}}
+)
+def test_coalesced_duplicate_returns_423_when_not_stored():
+    obj = IdempotencyKeyMiddleware()
+    leader = Request('mykey')
+    assert obj.generate_response(leader, 'mykey') is None
+
+    duplicate = Request('mykey')
+    results = []
+    thread = threading.Thread(target=lambda: results.append(obj.generate_response(duplicate, 'mykey')))
+    thread.start()
+
+    time.sleep(0.05)
+    obj.process_response(leader, HttpResponse(status=status.HTTP_400_BAD_REQUEST))
+    thread.join(timeout=5)
+
+    assert results[0].status_code == status.HTTP_423_LOCKED
+
+    # The reservation was released so the next attempt runs the view
+    assert obj.generate_response(Request('mykey'), 'mykey') is None
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'IN_FLIGHT_RESERVATION': True, 'COALESCE': True, 'COALESCE_TIMEOUT': 0.05}}
+)
+def test_coalesced_duplicate_times_out():
+    obj = IdempotencyKeyMiddleware()
+    assert obj.generate_response(Request('mykey'), 'mykey') is None
+
+    # Remove the event so the duplicate has to poll the storage as it would for a request in another process
+    obj.in_flight_events.clear()
+    response = obj.generate_response(Request('mykey'), 'mykey')
+    assert response.status_code == status.HTTP_423_LOCKED
@@ -0,0 +1,126 @@
+import pickle
+
+from django.test import override_settings
+import pytest
+
+from idempotency_key import status
+from idempotency_key.middleware import IdempotencyKeyMiddleware
+from idempotency_key.storage import IN_FLIGHT, RedisKeyStorage
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_obj = fakeredis.FakeRedis()
+    mocker.patch('idempotency_key.connections.get_redis_connection', return_value=redis_obj)
+    yield redis_obj
+    redis_obj.flushall()
+
+
+def test_redis_storage_store(fake_redis):
+    obj = RedisKeyStorage()
+    obj.store_data('default', 'key', 'value')
+    assert fake_redis.get('idempotency_key:default:key') == pickle.dumps('value')
+    # The default cache has the default django cache timeout of 5 minutes
+    assert 0 < fake_redis.pttl('idempotency_key:default:key') <= 300 * 1000
+
+
+def test_redis_storage_retrieve(fake_redis):
+    obj = RedisKeyStorage()
+    obj.store_data('default', 'key', 'value')
+    assert obj.retrieve_data('default', 'key') == (True, 'value')
+    assert obj.retrieve_data('default', 'other') == (False, None)
+    # Cache names do not share keys
+    assert obj.retrieve_data('FiveMinuteCache', 'key') == (False, None)
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'KEY_PREFIX': 'myprefix-'}}
+)
+def test_redis_storage_key_prefix(fake_redis):
+    obj = RedisKeyStorage()
+    obj.store_data('not_a_cache', 'key', 'value')
+    assert fake_redis.get('myprefix-not_a_cache:key') == pickle.dumps('value')
+    # Names that are not django caches expire after 5 minutes
+    assert 0 < fake_redis.pttl('myprefix-not_a_cache:key') <= 300 * 1000
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'TIMEOUT': 10}}
+)
+def test_redis_storage_timeout(fake_redis):
+    obj = RedisKeyStorage()
+    obj.store_data('default', 'key', 'value')
+    # The setting is used instead of the timeout of the django cache with the same name
+    assert 0 < fake_redis.pttl('idempotency_key:default:key') <= 10 * 1000
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'IN_FLIGHT_TTL': 10}}
+)
+def test_redis_storage_reserve_and_release(fake_redis):
+    obj = RedisKeyStorage()
+    assert obj.reserve_key('default', 'key') is True
+    assert obj.reserve_key('default', 'key') is False
+    assert obj.retrieve_data('default', 'key') == (True, IN_FLIGHT)
+    assert 0 < fake_redis.pttl('idempotency_key:default:key') <= 10 * 1000
+
+    obj.release_key('default', 'key')
+    assert obj.retrieve_data('default', 'key') == (False, None)
+
+    # Stored responses are never released
+    assert obj.reserve_key('default', 'key') is True
+    obj.store_data('default', 'key', 'value')
+    obj.release_key('default', 'key')
+    assert obj.retrieve_data('default', 'key') == (True, 'value')
+
+
+def test_redis_storage_retrieve_or_reserve(fake_redis):
+    obj = RedisKeyStorage()
+    assert obj.retrieve_or_reserve('default', 'key') == (False, None)
+    assert obj.retrieve_or_reserve('default', 'key') == (True, IN_FLIGHT)
+
+    obj.store_data('default', 'key', 'value')
+    assert obj.retrieve_or_reserve('default', 'key') == (True, 'value')
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'LOCATION': ''}}
+)
+def test_redis_storage_location_must_be_set():
+    with pytest.raises(ValueError):
+        RedisKeyStorage()
+
+
+def test_redis_storage_retrieve_or_reserve_single_round_trip(fake_redis, mocker):
+    obj = RedisKeyStorage()
+    # The first call loads the script into the server
+    obj.retrieve_or_reserve('default', 'key1')
+
+    execute_command = mocker.spy(fake_redis, 'execute_command')
+    assert obj.retrieve_or_reserve('default', 'key2') == (False, None)
+    assert obj.retrieve_or_reserve('default', 'key2') == (True, IN_FLIGHT)
+    obj.store_data('default', 'key2', 'value')
+    execute_command.reset_mock()
+    assert obj.retrieve_or_reserve('default', 'key2') == (True, 'value')
+    assert execute_command.call_count == 1
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={
+        'STORAGE': {
+            'CLASS': 'idempotency_key.storage.RedisKeyStorage',
+            'IN_FLIGHT_RESERVATION': True,
+        },
+    }
+)
+def test_redis_storage_middleware_does_not_lock(fake_redis, mocker):
+    class Request:
+        idempotency_key_manual = False
+        idempotency_key_cache_name = 'default'
+
+    obj = IdempotencyKeyMiddleware()
+    acquire = mocker.spy(obj.storage_lock, 'acquire')
+    assert obj.generate_response(Request(), 'key') is None
+    assert obj.generate_response(Request(), 'key').status_code == status.HTTP_423_LOCKED
+    assert acquire.call_count == 0
@@ -0,0 +1,169 @@
+import threading
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import override_settings
+
+from idempotency_key import status
+from idempotency_key.storage import IN_FLIGHT, MemoryKeyStorage, WriteBehindKeyStorage
+from tests.tests.utils import set_middleware
+
+the_key = '7495e32b-709b-4fae-bfd4-2497094bf3fd'
+
+
+class BlockingStorage(MemoryKeyStorage):
+    """
+    Blocks each store_data call made by the write-behind worker until `unblocked` is set and records every call.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.unblocked = threading.Event()
+        self.stored = []
+        self.store_threads = []
+
+    def store_data(self, cache_name, encoded_key, response):
+        self.store_threads.append(threading.current_thread())
+        if threading.current_thread().name == 'idempotency-key-write-behind':
+            self.unblocked.wait(5)
+        self.stored.append((encoded_key, response))
+        super().store_data(cache_name, encoded_key, response)
+
+
+def test_store_returns_before_write():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner)
+    response = HttpResponse('created', status=status.HTTP_201_CREATED)
+
+    storage.store_data('default', 'key1', response)
+    assert inner.retrieve_data('default', 'key1') == (False, None)
+
+    # The queued response is found by lookups in this process before it is written
+    key_exists, queued_response = storage.retrieve_data('default', 'key1')
+    assert key_exists is True
+    assert queued_response.content == b'created'
+    assert storage.retrieve_or_reserve('default', 'key1')[0] is True
+    assert storage.reserve_key('default', 'key1') is False
+
+    inner.unblocked.set()
+    assert storage.flush(5) is True
+    assert inner.retrieve_data('default', 'key1')[0] is True
+    assert not storage.pending
+
+
+def test_queued_response_is_a_copy():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner)
+    response = HttpResponse('created')
+
+    storage.store_data('default', 'key1', response)
+    response['X-Added-Later'] = 'yes'
+    response.set_cookie('later', 'yes')
+
+    queued_response = storage.retrieve_data('default', 'key1')[1]
+    assert not queued_response.has_header('X-Added-Later')
+    assert 'later' not in queued_response.cookies
+    inner.unblocked.set()
+    storage.flush(5)
+
+
+def test_lookups_return_a_copy():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner)
+    storage.store_data('default', 'key1', HttpResponse('created', status=status.HTTP_201_CREATED))
+
+    # Replaying the response changes its status code, which must not change the response that is written
+    storage.retrieve_data('default', 'key1')[1].status_code = status.HTTP_409_CONFLICT
+    storage.retrieve_or_reserve('default', 'key1')[1].status_code = status.HTTP_409_CONFLICT
+    assert storage.retrieve_data('default', 'key1')[1].status_code == status.HTTP_201_CREATED
+
+    inner.unblocked.set()
+    storage.flush(5)
+    assert inner.retrieve_data('default', 'key1')[1].status_code == status.HTTP_201_CREATED
+
+
+class FailingStorage(MemoryKeyStorage):
+    def store_data(self, cache_name, encoded_key, response):
+        raise ConnectionError('The storage is unavailable')
+
+
+def test_failed_write_releases_reservation():
+    inner = FailingStorage()
+    storage = WriteBehindKeyStorage(inner)
+
+    assert storage.retrieve_or_reserve('default', 'key1') == (False, None)
+    storage.store_data('default', 'key1', HttpResponse('1'))
+    storage.flush(5)
+
+    # The request can be retried instead of being locked out until the reservation expires
+    assert inner.retrieve_data('default', 'key1') == (False, None)
+
+
+def test_stores_of_the_same_key_are_coalesced():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner)
+
+    # The worker is blocked writing key1 while key2 is stored three times
+    storage.store_data('default', 'key1', HttpResponse('1'))
+    for content in ('a', 'b', 'c'):
+        storage.store_data('default', 'key2', HttpResponse(content))
+
+    inner.unblocked.set()
+    storage.flush(5)
+    assert [(key, response.content) for key, response in inner.stored] == [('key1', b'1'), ('key2', b'c')]
+
+
+def test_full_queue_writes_synchronously():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner, queue_size=1)
+
+    storage.store_data('default', 'key1', HttpResponse('1'))
+    storage.store_data('default', 'key2', HttpResponse('2'))
+    assert inner.stored[0][0] == 'key2'
+    assert inner.store_threads[-1] is threading.current_thread()
+
+    inner.unblocked.set()
+    storage.flush(5)
+
+
+def test_async_lookup_of_queued_response():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner)
+
+    async def store_and_retrieve():
+        await storage.astore_data('default', 'key1', HttpResponse('1'))
+        return await storage.aretrieve_or_reserve('default', 'key1')
+
+    assert async_to_sync(store_and_retrieve)()[0] is True
+    inner.unblocked.set()
+    storage.flush(5)
+
+
+def test_reservation_kept_until_written():
+    inner = BlockingStorage()
+    storage = WriteBehindKeyStorage(inner)
+
+    assert storage.retrieve_or_reserve('default', 'key1') == (False, None)
+    storage.store_data('default', 'key1', HttpResponse('1'))
+    # Other processes see the reservation until the response is written
+    assert inner.retrieve_data('default', 'key1') == (True, IN_FLIGHT)
+
+    inner.unblocked.set()
+    storage.flush(5)
+    assert inner.retrieve_data('default', 'key1')[1].content == b'1'
+
+
+@set_middleware
+@override_settings(IDEMPOTENCY_KEY={'STORAGE': {'WRITE_BEHIND': True}})
+def test_middleware_write_behind(client):
+    voucher_data = {
+        'id': 1,
+        'name': 'myvoucher0',
+        'internal_name': 'myvoucher0',
+    }
+    response = client.post('/views/create/', voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response2 = client.post('/views/create/', voucher_data, secure=True, HTTP_IDEMPOTENCY_KEY=the_key)
+    assert response2.status_code == status.HTTP_409_CONFLICT
+    assert response2.wsgi_request.idempotency_key_exists is True
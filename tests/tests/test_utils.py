@@ -156,3 +156,34 @@ def test_get_lock_location_only_host():
 def test_get_lock_location_host_and_port():
     location = utils.get_lock_location()
     assert location == 'testname:1234'
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={}
+)
+def test_get_settings_default():
+    idempotency_key_settings = utils.get_settings()
+    assert idempotency_key_settings.conflict_code == status.HTTP_409_CONFLICT
+    assert idempotency_key_settings.storage_cache_name == 'default'
+    assert idempotency_key_settings.storage_store_on_statuses == frozenset(utils.get_storage_store_on_statuses())
+    assert idempotency_key_settings.lock_enable is True
+
+    # The same snapshot is used until the settings change
+    assert utils.get_settings() is idempotency_key_settings
+
+
+def test_get_settings_rebuilt_when_settings_change():
+    idempotency_key_settings = utils.get_settings()
+    with override_settings(IDEMPOTENCY_KEY={'CONFLICT_STATUS_CODE': None, 'LOCK': {'ENABLE': False}}):
+        assert utils.get_settings().conflict_code is None
+        assert utils.get_settings().lock_enable is False
+
+    assert utils.get_settings() is not idempotency_key_settings
+    assert utils.get_settings() == idempotency_key_settings
+
+
+@override_settings(
+    IDEMPOTENCY_KEY={'STORAGE': {'STORE_ON_STATUSES': [status.HTTP_200_OK]}, }
+)
+def test_get_settings_store_on_statuses():
+    assert utils.get_settings().storage_store_on_statuses == frozenset([status.HTTP_200_OK])
@@ -1,3 +1,7 @@
+from collections import Counter
+import threading
+import time
+
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -71,3 +75,18 @@ def create_manual_exempt_2(request, *args, **kwargs):
 @api_view(['POST'])
 def create_with_my_cache(request, *args, **kwargs):
     return Response(status=201, data={})
+
+
+# The number of times create_counted has run for each idempotency key and how long it takes to run
+view_executions = Counter()
+view_executions_lock = threading.Lock()
+view_delay = 0.0
+
+
+@idempotency_key
+@api_view(['POST'])
+def create_counted(request, *args, **kwargs):
+    with view_executions_lock:
+        view_executions[request.META.get('IDEMPOTENCY_KEY')] += 1
+    time.sleep(view_delay)
+    return Response(status=201, data={})